@@ -1,4 +1,6 @@
 import os
+import re
+import warnings
 from pathlib import Path
 
 import yaml
@@ -6,12 +8,43 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# libyaml-backed loader when PyYAML was built with it, pure-Python otherwise
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+if _YamlLoader is yaml.SafeLoader:
+    warnings.warn(
+        "PyYAML is built without libyaml, falling back to the pure-Python SafeLoader. "
+        "Install libyaml-dev and reinstall PyYAML for faster config loading.",
+        ImportWarning,
+    )
+
+
+def _trie_pattern(words: list[str]) -> str:
+    """
+    Regex alternation with shared prefixes factored out ("заработ(?:ать|ок)"), so each
+    text position is matched against a trie instead of every word in turn. Words that
+    extend a shorter word ("продам usdt" after "продам") are dropped: search() can't tell.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}  # end of word
+
+    def build(node: dict) -> str:
+        if "" in node:
+            return ""
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        return alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+
+    return build(trie)
+
 
 class Config:
     def __init__(self):
         config_path = Path(__file__).parent.parent / "config.yaml"
         with open(config_path) as f:
-            self._yaml = yaml.safe_load(f)
+            self._yaml = yaml.load(f, Loader=_YamlLoader)
 
         # Telegram Userbot
         self.telegram_api_id = int(os.environ["TELEGRAM_API_ID"])
@@ -38,10 +71,17 @@ class Config:
             f"postgresql://{os.environ['POSTGRES_USER']}:{os.environ['POSTGRES_PASSWORD']}"
             f"@{os.environ['POSTGRES_HOST']}:{os.environ['POSTGRES_PORT']}/{os.environ['POSTGRES_DB']}"
         )
+        self.db_pool_size = int(os.environ.get("DB_POOL_SIZE", "10"))
+        self.db_max_overflow = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
 
         # Settings from YAML
         self.folder_name = self._yaml["telegram"]["folder_name"]
-        self.exclude_words = [w.lower() for w in self._yaml["filter"]["exclude_words"]]
+        self.exclude_words = [w.lower() for w in self._yaml["filter"]["exclude_words"] if w]
+        # Single compiled trie-shaped alternation: one C-level scan per text instead of a Python loop over words
+        self.exclude_re = (
+            re.compile(_trie_pattern(self.exclude_words), re.IGNORECASE)
+            if self.exclude_words else None
+        )
         self.interval_minutes = self._yaml["scheduler"]["interval_minutes"]
         
         # Scan mode: timer (auto-scan) or manual (bot commands only)
@@ -55,5 +95,11 @@ class Config:
         self.chrome_cdp_url = os.environ.get("CHROME_CDP_URL", "http://localhost:9222")
 
 
-config = Config()
+def __getattr__(name: str):
+    """Create the `config` singleton on first access (PEP 562)"""
+    if name == "config":
+        global config
+        config = Config()
+        return config
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
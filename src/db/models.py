@@ -1,7 +1,10 @@
+import asyncio
+import enum
+import threading
 from datetime import datetime
 
-from sqlalchemy import BigInteger, Boolean, DateTime, Float, ForeignKey, String, Text, create_engine
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, sessionmaker
+from sqlalchemy import BigInteger, Boolean, DateTime, Enum, Float, ForeignKey, Index, String, Text, create_engine, func, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, scoped_session, sessionmaker
 
 from src.config import config
 
@@ -10,6 +13,16 @@ class Base(DeclarativeBase):
     pass
 
 
+def utc_now():
+    """Database-side current UTC time (columns store naive UTC timestamps)"""
+    return func.timezone("utc", func.now())
+
+
+class SourceEnum(str, enum.Enum):
+    telegram = "telegram"
+    facebook = "facebook"
+
+
 class ProcessedUser(Base):
     __tablename__ = "processed_users"
 
@@ -17,13 +30,18 @@ class ProcessedUser(Base):
     telegram_user_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
     username: Mapped[str | None] = mapped_column(String(255), nullable=True)
     first_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=utc_now())
 
     messages: Mapped[list["Message"]] = relationship(back_populates="user")
 
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_lead_lookup", "chat_id", "is_lead", "created_at"),
+        # Partial index: only analyzed rows, keeps it small and hot in cache
+        Index("ix_messages_source_lead", "source", "is_lead", postgresql_where=text("is_lead IS NOT NULL")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     telegram_message_id: Mapped[int] = mapped_column(BigInteger)
@@ -37,7 +55,9 @@ class Message(Base):
     reason: Mapped[str | None] = mapped_column(String(500), nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime)
     analyzed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    source: Mapped[str] = mapped_column(String(20), default="telegram")  # telegram or facebook
+    source: Mapped[SourceEnum] = mapped_column(
+        Enum(SourceEnum, name="message_source"), default=SourceEnum.telegram, nullable=False
+    )
 
     user: Mapped[ProcessedUser] = relationship(back_populates="messages")
 
@@ -47,7 +67,7 @@ class ChatState(Base):
 
     chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     last_message_id: Mapped[int] = mapped_column(BigInteger)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=utc_now(), onupdate=utc_now())
 
 
 class FacebookGroupState(Base):
@@ -57,22 +77,89 @@ class FacebookGroupState(Base):
     group_id: Mapped[str] = mapped_column(String(100), primary_key=True)
     group_name: Mapped[str | None] = mapped_column(String(255), nullable=True)
     last_scan_time: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=utc_now(), onupdate=utc_now())
 
 
 class FacebookProcessedPost(Base):
     """Tracks which Facebook posts have already been processed"""
     __tablename__ = "facebook_processed_posts"
 
+    # IDs stay strings: post_id may be a text-hash fallback and group_id a vanity slug.
+    # VARCHAR is stored at its actual length, so a narrower declared limit wouldn't
+    # shrink the PK index; the table is insert-only, so default fillfactor (100) is densest.
+
     post_id: Mapped[str] = mapped_column(String(100), primary_key=True)
     group_id: Mapped[str] = mapped_column(String(100), index=True)
-    processed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    processed_at: Mapped[datetime] = mapped_column(DateTime, server_default=utc_now(), index=True)
 
 
-engine = create_engine(config.db_url)
-SessionLocal = sessionmaker(bind=engine)
+engine = create_engine(
+    config.db_url,
+    pool_size=config.db_pool_size,
+    max_overflow=config.db_max_overflow,
+    pool_pre_ping=True,  # Drop stale connections after Postgres restarts / idle timeouts
+    pool_recycle=1800,
+    # psycopg2: multi-row VALUES for INSERT executemany, execute_batch() for UPDATE/DELETE
+    executemany_mode="values_plus_batch",
+    insertmanyvalues_page_size=500,
+    executemany_batch_page_size=500,
+)
+
+
+def _session_scope():
+    """
+    Scope key for SessionLocal: the current asyncio task, so the Telegram and
+    Facebook cycles running concurrently in one thread get separate sessions.
+    Falls back to the thread outside an event loop.
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # no running event loop
+        task = None
+    return task if task is not None else threading.get_ident()
+
+
+SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False), scopefunc=_session_scope)
 
 
 def init_db():
     Base.metadata.create_all(engine)
-
+    with engine.begin() as conn:
+        _upgrade_existing_tables(conn)
+
+
+def _upgrade_existing_tables(conn):
+    """
+    create_all() only creates missing tables, so apply schema changes
+    introduced after the tables were first created. Every step is idempotent.
+    """
+    # Server-side defaults, only where the column has none yet (ALTER TABLE takes an exclusive lock)
+    without_default = set(conn.execute(text(
+        "SELECT table_name, column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND column_default IS NULL"
+    )).all())
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if column.server_default is not None and (table.name, column.name) in without_default:
+                default = column.server_default.arg.compile(
+                    dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                )
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT {default}"))
+
+    # messages.source: VARCHAR(20) -> native message_source enum
+    source_type = conn.execute(text(
+        "SELECT udt_name FROM information_schema.columns "
+        "WHERE table_name = 'messages' AND column_name = 'source'"
+    )).scalar()
+    if source_type != "message_source":
+        Message.__table__.c.source.type.create(conn, checkfirst=True)
+        conn.execute(text("UPDATE messages SET source = 'telegram' WHERE source IS NULL"))
+        conn.execute(text(
+            "ALTER TABLE messages ALTER COLUMN source TYPE message_source USING source::message_source, "
+            "ALTER COLUMN source SET NOT NULL"
+        ))
+
+    # Indexes (create_all() only builds them together with new tables)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
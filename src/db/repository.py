@@ -1,125 +1,176 @@
+from collections.abc import Iterator
 from datetime import datetime
 
+from cachetools import TTLCache
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
-from src.db.models import ChatState, FacebookGroupState, FacebookProcessedPost, Message, ProcessedUser, SessionLocal
+from src.db.models import ChatState, FacebookGroupState, FacebookProcessedPost, Message, ProcessedUser, SessionLocal, utc_now
+
+# Known rows shared across sessions. Users and processed posts are never deleted,
+# so a confirmed entry can't go stale; misses always go to the DB.
+_user_cache: TTLCache = TTLCache(maxsize=50_000, ttl=3600)  # telegram_user_id -> (username, first_name, id)
+_post_cache: TTLCache = TTLCache(maxsize=100_000, ttl=1800)  # post_id -> True
 
 
 class Repository:
+    """
+    Unit of work over one Session. Write methods don't commit:
+    use `with Repository() as repo:` to commit once on success
+    (or roll back on exception), or call commit() explicitly.
+    """
+
     def __init__(self):
+        # Same Session for every Repository within one task, see SessionLocal
         self.session: Session = SessionLocal()
+        # Rows written in this transaction, cached only once it commits
+        self._pending_users: dict[int, tuple] = {}
+        self._pending_posts: list[str] = []
+
+    def __enter__(self) -> "Repository":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.session.rollback()
+        finally:
+            self.close()
+
+    def commit(self):
+        self.session.commit()
+        _user_cache.update(self._pending_users)
+        for post_id in self._pending_posts:
+            _post_cache[post_id] = True
+        self._pending_users.clear()
+        self._pending_posts.clear()
 
     def close(self):
-        self.session.close()
-
-    def get_or_create_user(self, telegram_user_id: int, username: str | None, first_name: str | None) -> ProcessedUser:
-        user = self.session.query(ProcessedUser).filter_by(telegram_user_id=telegram_user_id).first()
-        if not user:
-            user = ProcessedUser(
-                telegram_user_id=telegram_user_id,
-                username=username,
-                first_name=first_name,
-            )
-            self.session.add(user)
-            self.session.commit()
-        return user
-
-    def is_user_processed(self, telegram_user_id: int) -> bool:
-        return self.session.query(ProcessedUser).filter_by(telegram_user_id=telegram_user_id).first() is not None
-
-    def save_message(
-        self,
-        telegram_message_id: int,
-        chat_id: int,
-        chat_title: str | None,
-        chat_username: str | None,
-        user: ProcessedUser,
-        text: str,
-        created_at: datetime,
-        source: str = "telegram",
-    ) -> Message:
-        msg = Message(
-            telegram_message_id=telegram_message_id,
-            chat_id=chat_id,
-            chat_title=chat_title,
-            chat_username=chat_username,
-            user_id=user.id,
-            text=text,
-            created_at=created_at,
-            source=source,
+        """Close the session and drop it from the scoped registry (call at cycle boundary)"""
+        SessionLocal.remove()
+
+    def get_or_create_users_bulk(self, users: list[tuple[int, str | None, str | None]]) -> dict[int, int]:
+        """
+        Upsert many users in one statement. users = [(telegram_user_id, username, first_name), ...]
+        Returns {telegram_user_id: processed_users.id}
+        """
+        # ON CONFLICT can't touch the same row twice in one statement: keep the latest values per user
+        latest = {telegram_user_id: (username, first_name) for telegram_user_id, username, first_name in users}
+        user_ids = {}
+        rows = []
+        for telegram_user_id, names in latest.items():
+            cached = _user_cache.get(telegram_user_id)
+            if cached is not None and cached[:2] == names:
+                user_ids[telegram_user_id] = cached[2]  # Known user, names unchanged: nothing to write
+            else:
+                rows.append({"telegram_user_id": telegram_user_id, "username": names[0], "first_name": names[1]})
+        if rows:
+            stmt = pg_insert(ProcessedUser).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ProcessedUser.telegram_user_id],
+                set_={"username": stmt.excluded.username, "first_name": stmt.excluded.first_name},
+            ).returning(ProcessedUser.telegram_user_id, ProcessedUser.id)
+            for telegram_user_id, user_id in self.session.execute(stmt):
+                self._pending_users[telegram_user_id] = (*latest[telegram_user_id], user_id)
+                user_ids[telegram_user_id] = user_id
+        return user_ids
+
+    def save_messages_bulk(self, rows: list[dict]):
+        """
+        Insert many messages at once, bypassing per-object unit-of-work overhead.
+        Each row is a dict of Message columns with user_id already resolved.
+        """
+        if rows:
+            self.session.bulk_insert_mappings(Message, rows)
+
+    def iter_leads(self, since: datetime, batch_size: int = 500) -> Iterator[Message]:
+        """Stream leads analyzed since `since`, fetching `batch_size` rows at a time"""
+        stmt = (
+            select(Message)
+            .where(Message.is_lead.is_(True), Message.analyzed_at >= since)
+            .order_by(Message.analyzed_at)
+            .execution_options(yield_per=batch_size)
         )
-        self.session.add(msg)
-        self.session.commit()
-        return msg
-
-    def update_message_lead_status(self, message_id: int, is_lead: bool, confidence: float = 0.0, reason: str = ""):
-        msg = self.session.query(Message).filter_by(id=message_id).first()
-        if msg:
-            msg.is_lead = is_lead
-            msg.confidence = confidence
-            msg.reason = reason
-            msg.analyzed_at = datetime.utcnow()
-            self.session.commit()
+        yield from self.session.scalars(stmt)
 
     def get_last_message_id(self, chat_id: int) -> int | None:
-        state = self.session.query(ChatState).filter_by(chat_id=chat_id).first()
+        state = self.session.get(ChatState, chat_id)
         return state.last_message_id if state else None
 
+    def preload_chat_states(self, chat_ids: list[int]) -> dict[int, int]:
+        """Get last message ids for many chats in one query. Returns {chat_id: last_message_id}"""
+        if not chat_ids:
+            return {}
+        stmt = select(ChatState).where(ChatState.chat_id.in_(chat_ids))
+        return {state.chat_id: state.last_message_id for state in self.session.scalars(stmt)}
+
     def update_last_message_id(self, chat_id: int, message_id: int):
-        state = self.session.query(ChatState).filter_by(chat_id=chat_id).first()
-        if state:
-            state.last_message_id = message_id
-            state.updated_at = datetime.utcnow()
-        else:
-            state = ChatState(chat_id=chat_id, last_message_id=message_id)
-            self.session.add(state)
-        self.session.commit()
+        stmt = (
+            pg_insert(ChatState)
+            .values(chat_id=chat_id, last_message_id=message_id)
+            .on_conflict_do_update(
+                index_elements=[ChatState.chat_id],
+                set_={"last_message_id": message_id, "updated_at": utc_now()},
+            )
+            .returning(ChatState)
+        )
+        # populate_existing refreshes a ChatState already loaded by get_last_message_id()
+        self.session.scalars(stmt, execution_options={"populate_existing": True}).one()
 
     # Facebook methods
     def get_facebook_group_state(self, group_id: str) -> datetime | None:
         """Get last scan time for a Facebook group"""
-        state = self.session.query(FacebookGroupState).filter_by(group_id=group_id).first()
+        state = self.session.get(FacebookGroupState, group_id)
         return state.last_scan_time if state else None
 
     def update_facebook_group_state(self, group_id: str, group_name: str, scan_time: datetime):
         """Update last scan time for a Facebook group"""
-        state = self.session.query(FacebookGroupState).filter_by(group_id=group_id).first()
-        if state:
-            state.group_name = group_name
-            state.last_scan_time = scan_time
-            state.updated_at = datetime.utcnow()
-        else:
-            state = FacebookGroupState(
-                group_id=group_id,
-                group_name=group_name,
-                last_scan_time=scan_time
+        stmt = (
+            pg_insert(FacebookGroupState)
+            .values(group_id=group_id, group_name=group_name, last_scan_time=scan_time)
+            .on_conflict_do_update(
+                index_elements=[FacebookGroupState.group_id],
+                set_={"group_name": group_name, "last_scan_time": scan_time, "updated_at": utc_now()},
             )
-            self.session.add(state)
-        self.session.commit()
-
-    def is_facebook_post_processed(self, post_id: str) -> bool:
-        """Check if a Facebook post has already been processed"""
-        return self.session.query(FacebookProcessedPost).filter_by(post_id=post_id).first() is not None
-
-    def mark_facebook_post_processed(self, post_id: str, group_id: str):
-        """Mark a Facebook post as processed"""
-        if not self.is_facebook_post_processed(post_id):
-            post = FacebookProcessedPost(post_id=post_id, group_id=group_id)
-            self.session.add(post)
-            self.session.commit()
+            .returning(FacebookGroupState)
+        )
+        self.session.scalars(stmt, execution_options={"populate_existing": True}).one()
+
+    def get_processed_post_ids(self, since: datetime | None = None) -> set[str]:
+        """Get IDs of already processed Facebook posts (only those processed since `since` if given)"""
+        # yield_per streams from a server-side cursor instead of buffering all rows first
+        stmt = select(FacebookProcessedPost.post_id).execution_options(yield_per=10_000)
+        if since is not None:
+            stmt = stmt.where(FacebookProcessedPost.processed_at >= since)
+        return set(self.session.scalars(stmt))
+
+    def find_processed_post_ids(self, post_ids: list[str]) -> set[str]:
+        """Which of post_ids are already processed, in one IN query"""
+        found = {post_id for post_id in post_ids if post_id in _post_cache}
+        rest = [post_id for post_id in post_ids if post_id not in found]
+        if rest:
+            stmt = select(FacebookProcessedPost.post_id).where(FacebookProcessedPost.post_id.in_(rest))
+            for post_id in self.session.scalars(stmt):
+                _post_cache[post_id] = True
+                found.add(post_id)
+        return found
 
     def mark_facebook_posts_batch(self, posts: list[tuple[str, str]]):
         """Mark multiple Facebook posts as processed. posts = [(post_id, group_id), ...]"""
-        for post_id, group_id in posts:
-            if not self.is_facebook_post_processed(post_id):
-                post = FacebookProcessedPost(post_id=post_id, group_id=group_id)
-                self.session.add(post)
-        self.session.commit()
+        rows = [{"post_id": post_id, "group_id": group_id} for post_id, group_id in posts if post_id not in _post_cache]
+        if not rows:
+            return
+        stmt = pg_insert(FacebookProcessedPost).values(rows).on_conflict_do_nothing(
+            index_elements=[FacebookProcessedPost.post_id]
+        )
+        self.session.execute(stmt)
+        self._pending_posts.extend(row["post_id"] for row in rows)
 
     def reset_telegram_chat_states(self) -> int:
         """Reset all Telegram chat states to re-process messages from last 24h"""
-        count = self.session.query(ChatState).delete()
-        self.session.commit()
-        return count
+        return self.session.query(ChatState).delete()
 
 
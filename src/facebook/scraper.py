@@ -4,15 +4,158 @@ Connects to existing Chrome via CDP for authenticated session.
 """
 
 import asyncio
+import hashlib
+import json
 import re
+import time
 from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
 from typing import Optional
 
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 
 from src.utils.logger import logger
 
+_POST_ID_RE = re.compile(r'/(?:posts|permalink)/(\d+)')
+_GROUP_ID_RE = re.compile(r'/groups/(\d+|[^/?]+)')
+# Special pages and navigation links on the "Your groups" page
+_SKIP_HREF_RE = re.compile(r'category=create|/groups/(?:feed|discover|search|joins|notifications)')
+# Link texts of buttons that share the group link markup
+_BUTTON_PREFIXES = ("Создать", "Create", "Посмотреть", "View", "Ещё", "More")
+
+# Joined groups change rarely, so the full "Your groups" scroll is cached per account
+GROUPS_CACHE_PATH = Path(__file__).parent.parent.parent / "session" / "facebook_groups.json"
+GROUPS_CACHE_TTL = 6 * 3600
+
+# URLs the scraper never reads, blocked on worker pages via CDP. Unlike page.route() this
+# keeps the HTTP cache on, so the app shell JS is still cached across navigations.
+# Stylesheets are kept: feed lazy loading depends on layout
+_BLOCKED_URL_PATTERNS = [
+    "*//scontent*.fbcdn.net/*",  # post photos and avatars
+    "*//video*.fbcdn.net/*",
+    "*.woff*",
+    "*.ttf*",
+    "*facebook.com/tr*",  # tracking pixel
+]
+
+# Scrolls to the bottom until the list stops growing: height unchanged for 2s with no
+# loading spinner (10s if a spinner hangs), polled every 200ms without CDP round-trips.
+# Returns the number of scrolls.
+_SCROLL_TO_END_JS = """
+async () => {
+    const root = document.documentElement;
+    let height = 0;
+    let stableSince = Date.now();
+    let scrolls = 0;
+    const deadline = Date.now() + 180000;
+    while (Date.now() < deadline) {
+        if (root.scrollHeight !== height) {
+            height = root.scrollHeight;
+            stableSince = Date.now();
+            window.scrollTo(0, height);
+            scrolls++;
+        }
+        const stable = Date.now() - stableSince;
+        const loading = document.querySelector('div[role="main"] [role="progressbar"]') !== null;
+        if (stable >= 10000 || (stable >= 2000 && !loading)) {
+            break;
+        }
+        await new Promise(r => setTimeout(r, 200));
+    }
+    return scrolls;
+}
+"""
+
+
+def _group_id_from_url(url: str) -> Optional[str]:
+    """Group ID (or slug) from a /groups/ URL; plain numeric IDs skip the regex"""
+    start = url.find("/groups/") + len("/groups/")
+    if start >= len("/groups/"):
+        segment = url[start:].partition("/")[0].partition("?")[0]
+        if segment.isdigit():
+            return segment
+    match = _GROUP_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def _text_key(text: str) -> bytes:
+    """Stable digest of the post start for dedupe (built-in hash() is randomized per process)"""
+    return hashlib.blake2b(text[:100].encode("utf-8", "ignore"), digest_size=8).digest()
+
+
+# Matches post articles (with a post link, unlike ads and suggestion cards) not yet
+# returned by _EXTRACT_POSTS_JS
+_UNSEEN_ARTICLE = '[role="article"]:has(a[href*="/posts/"], a[href*="/permalink/"]):not([data-leads-seen])'
+
+# Expands "See more" and extracts raw post fields from new feed articles in a single
+# CDP round-trip. Returned articles are marked, so each call yields only the delta since
+# the previous one (also when the feed drops old nodes). Returns one
+# {href, author, author_id, text} per article (already truncated to the stored lengths),
+# parsed in FacebookScraper._build_post().
+_EXTRACT_POSTS_JS = """
+async () => {
+    const articles = [...document.querySelectorAll('%s')];
+    articles.forEach(a => a.setAttribute("data-leads-seen", ""));
+
+    // Expand all truncated posts at once, then wait until every clicked button is
+    // gone (text expanded) or 300ms have passed, whichever comes first
+    const seeMore = articles
+        .map(article => [...article.querySelectorAll('div[role="button"]')]
+            .find(b => /See more|Ещё|Показать ещё/.test(b.innerText)))
+        .filter(Boolean);
+    seeMore.forEach(b => b.click());
+    if (seeMore.length) {
+        await Promise.race([
+            new Promise(r => {
+                const poll = () => seeMore.every(b => !b.isConnected) ? r() : setTimeout(poll, 50);
+                poll();
+            }),
+            new Promise(r => setTimeout(r, 300)),
+        ]);
+    }
+
+    // One joined selector = one DOM traversal per article (first match in document order)
+    const authorSelector = 'h2 a[role="link"], h3 a[role="link"], a[role="link"] strong, span[dir="auto"] > a[role="link"]';
+    return articles.map(article => {
+        const postLink = article.querySelector('a[href*="/posts/"], a[href*="/permalink/"]');
+
+        // innerText forces layout, so read it only up to the first match
+        let author = "";
+        for (const el of article.querySelectorAll(authorSelector)) {
+            const name = el.innerText.trim();
+            if (name.length > 1) {
+                author = name;
+                break;
+            }
+        }
+        // Author id from the profile link: /groups/<id>/user/<uid>/ or profile.php?id=<uid>
+        const profileLink = article.querySelector('a[href*="/user/"], a[href*="/profile.php"]');
+        const profileId = profileLink
+            ? (profileLink.getAttribute("href") || "").match(/[/]user[/]([0-9]+)|profile[.]php[?]id=([0-9]+)/)
+            : null;
+
+        // First substantive text block (skip buttons, timestamps, author name)
+        let text = "";
+        for (const div of article.querySelectorAll('div[dir="auto"]')) {
+            const t = div.innerText;
+            if (t && t.length > 30 && t.trim() !== author) {
+                text = t;
+                break;
+            }
+        }
+
+        // Truncate here so long posts don't cross CDP in full
+        return {
+            href: postLink ? postLink.getAttribute("href") : null,
+            author: author.slice(0, 100),
+            author_id: profileId ? (profileId[1] || profileId[2]) : null,
+            text: text.trim().slice(0, 2000),
+        };
+    });
+}
+""" % _UNSEEN_ARTICLE
+
 
 @dataclass
 class ParsedPost:
@@ -70,12 +213,12 @@ class FacebookScraper:
             return False
     
     async def _apply_stealth(self):
-        """Apply stealth mode to avoid detection"""
-        if not self.page:
+        """Apply stealth mode to avoid detection (once per context, covers worker pages too)"""
+        if not self.context:
             return
             
         # Override navigator properties
-        await self.page.add_init_script("""
+        await self.context.add_init_script("""
             // Override webdriver property
             Object.defineProperty(navigator, 'webdriver', {
                 get: () => undefined
@@ -113,14 +256,61 @@ class FacebookScraper:
             await self.playwright.stop()
         logger.info("Facebook scraper disconnected")
     
-    async def get_user_groups(self) -> list[dict]:
+    async def get_user_groups(self, refresh: bool = False) -> list[dict]:
         """
         Get all groups the user is a member of.
+        Served from the on-disk cache for GROUPS_CACHE_TTL unless refresh=True.
         Returns list of {id, name, url}
         """
         if not self.page:
             return []
         
+        account_id = await self._get_account_id()
+        if not refresh:
+            groups = self._load_cached_groups(account_id)
+            if groups:
+                logger.info(f"Using {len(groups)} cached groups")
+                return groups
+        
+        groups = await self._fetch_user_groups()
+        if groups:
+            self._save_cached_groups(account_id, groups)
+        return groups
+    
+    async def _get_account_id(self) -> str:
+        """Logged-in Facebook user id (c_user cookie)"""
+        try:
+            cookies = await self.context.cookies("https://www.facebook.com")
+            return next((c["value"] for c in cookies if c["name"] == "c_user"), "default")
+        except Exception:
+            return "default"
+    
+    def _load_cached_groups(self, account_id: str) -> Optional[list[dict]]:
+        """Cached groups for the account, None if missing or expired"""
+        try:
+            cache = json.loads(GROUPS_CACHE_PATH.read_text())
+            entry = cache[account_id]
+        except (OSError, ValueError, KeyError):
+            return None
+        if time.time() - entry["saved_at"] > GROUPS_CACHE_TTL:
+            return None
+        return entry["groups"]
+    
+    def _save_cached_groups(self, account_id: str, groups: list[dict]):
+        try:
+            cache = json.loads(GROUPS_CACHE_PATH.read_text())
+        except (OSError, ValueError):
+            cache = {}
+        cache[account_id] = {"saved_at": time.time(), "groups": groups}
+        try:
+            GROUPS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            GROUPS_CACHE_PATH.write_text(json.dumps(cache, ensure_ascii=False))
+        except OSError as e:
+            logger.warning(f"Failed to save groups cache: {e}")
+    
+    async def _fetch_user_groups(self) -> list[dict]:
+        """Scroll the "Your groups" page to the end and parse all group links"""
+        
         groups = []
         
         try:
@@ -135,73 +325,36 @@ class FacebookScraper:
             except:
                 pass
             
-            # Scroll to load ALL groups until end of list
-            prev_scroll_height = 0
-            no_change_count = 0
-            scroll_num = 0
-            
-            while True:
-                scroll_num += 1
-                # Get current scroll height (use documentElement for Facebook)
-                scroll_height = await self.page.evaluate("document.documentElement.scrollHeight")
-                
-                # Check if scroll height changed
-                if scroll_height == prev_scroll_height:
-                    no_change_count += 1
-                    if no_change_count >= 5:  # 5 attempts with no change = end of list
-                        logger.debug(f"Scroll stopped after {scroll_num} scrolls, no new content")
-                        break
-                else:
-                    no_change_count = 0
-                
-                prev_scroll_height = scroll_height
-                
-                # Scroll to bottom
-                await self.page.evaluate("window.scrollTo(0, document.documentElement.scrollHeight)")
-                
-                # Wait for new content to load
-                try:
-                    await self.page.wait_for_function(
-                        f"document.documentElement.scrollHeight > {scroll_height}",
-                        timeout=3000
-                    )
-                except:
-                    # If wait fails, still wait a fixed time for content to load
-                    await asyncio.sleep(2)
+            # Scroll to load ALL groups until end of list (end detection runs in the page)
+            scroll_num = await self.page.evaluate(_SCROLL_TO_END_JS)
+            logger.debug(f"Scroll stopped after {scroll_num} scrolls, no new content")
             
-            # Parse groups from main content area only
-            group_links = await self.page.query_selector_all('div[role="main"] a[role="link"][href*="/groups/"]')
+            # Parse groups from main content area only (href and text of all links in one round-trip)
+            group_links = await self.page.eval_on_selector_all(
+                'div[role="main"] a[role="link"][href*="/groups/"]',
+                'links => links.map(a => ({href: a.getAttribute("href"), name: a.innerText}))'
+            )
             logger.info(f"Total group links found after scrolling: {len(group_links)}")
             
             seen_ids = set()
             for link in group_links:
                 try:
-                    href = await link.get_attribute("href")
+                    href = link["href"]
                     if not href:
                         continue
                     
                     # Skip special pages and navigation links
-                    skip_patterns = [
-                        "category=create",  # "Create new group" button
-                        "/groups/feed",
-                        "/groups/discover", 
-                        "/groups/search",
-                        "/groups/joins",
-                        "/groups/notifications",
-                    ]
-                    if any(pattern in href for pattern in skip_patterns):
+                    if _SKIP_HREF_RE.search(href):
                         continue
                     
                     # Extract group ID from URL
                     # Pattern: /groups/{group_id}/
-                    match = re.search(r'/groups/(\d+|[^/?]+)/?', href)
-                    if not match:
+                    group_id = _group_id_from_url(href)
+                    if not group_id:
                         continue
                     
-                    group_id = match.group(1)
-                    
                     # Get group name from link text BEFORE checking seen_ids
-                    name = await link.inner_text() or ""
+                    name = link["name"] or ""
                     name = name.strip()
                     
                     # Skip empty or too short names
@@ -209,8 +362,7 @@ class FacebookScraper:
                         continue
                     
                     # Skip if name looks like a button text
-                    button_texts = ["Создать", "Create", "Посмотреть", "View", "Ещё", "More"]
-                    if any(name.startswith(btn) for btn in button_texts):
+                    if name.startswith(_BUTTON_PREFIXES):
                         continue
                     
                     # NOW check if already seen (after all validations passed)
@@ -225,7 +377,7 @@ class FacebookScraper:
                     groups.append({
                         "id": group_id,
                         "name": name[:100],
-                        "url": href.split("?")[0]
+                        "url": href.partition("?")[0]
                     })
                     
                 except Exception:
@@ -257,13 +409,18 @@ class FacebookScraper:
         
         try:
             # Extract group info from URL
-            match = re.search(r'/groups/(\d+|[^/]+)', group_url)
-            group_id = match.group(1) if match else "unknown"
+            group_id = _group_id_from_url(group_url) or "unknown"
             
             # Navigate to group - sort by new posts
             url_with_sort = f"{group_url}?sorting_setting=CHRONOLOGICAL"
-            await self.page.goto(url_with_sort, wait_until="domcontentloaded", timeout=30000)
-            await asyncio.sleep(2)  # Reduced delay
+            # "commit" returns as soon as the response starts; the first post is the real gate
+            await self.page.goto(url_with_sort, wait_until="commit", timeout=30000)
+            
+            # Wait for the first post instead of a fixed delay
+            try:
+                await self.page.wait_for_selector('[role="article"]', state="attached", timeout=15000)
+            except:
+                pass
             
             # Get group name from page
             group_name = await self._get_group_name()
@@ -274,29 +431,25 @@ class FacebookScraper:
             max_scrolls = 10
             
             while posts_found < limit and scroll_attempts < max_scrolls:
-                # Find all post articles
-                articles = await self.page.query_selector_all('[role="article"]')
+                # Extract all not yet parsed articles in one round-trip
+                raw_posts = await self.page.evaluate(_EXTRACT_POSTS_JS)
                 
-                for article in articles:
+                for raw in raw_posts:
                     if posts_found >= limit:
                         break
                     
-                    try:
-                        post = await self._parse_article(article, group_id, group_name)
-                        if not post:
-                            continue
-                        
-                        # Dedupe by text hash (within this session)
-                        text_hash = hash(post.text[:100])
-                        if text_hash in seen_texts:
-                            continue
-                        seen_texts.add(text_hash)
-                        
-                        posts.append(post)
-                        posts_found += 1
-                    except Exception as e:
-                        logger.debug(f"Error parsing article: {e}")
+                    post = self._build_post(raw, group_id, group_name)
+                    if not post:
                         continue
+                    
+                    # Dedupe by text hash (within this session)
+                    text_hash = _text_key(post.text)
+                    if text_hash in seen_texts:
+                        continue
+                    seen_texts.add(text_hash)
+                    
+                    posts.append(post)
+                    posts_found += 1
                 
                 # Scroll for more
                 await self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
@@ -330,8 +483,6 @@ class FacebookScraper:
         Returns:
             List of all NEW posts from all groups
         """
-        import time
-        
         if not self.context:
             logger.error("No browser context available")
             return []
@@ -347,12 +498,11 @@ class FacebookScraper:
             num_workers = min(max_workers, len(groups))
             for _ in range(num_workers):
                 page = await self.context.new_page()
-                await self._apply_stealth_to_page(page)
+                await self._block_heavy_resources(page)
                 pages.append(page)
             
             logger.info(f"Created {len(pages)} parallel pages for scraping")
             
-            # Process groups in batches
             async def scrape_group(page: Page, group: dict) -> list[ParsedPost]:
                 """Scrape a single group, stop when hitting processed post"""
                 group_start = time.time()
@@ -365,24 +515,24 @@ class FacebookScraper:
                     # Navigate to group - chronological order (newest first)
                     nav_start = time.time()
                     url_with_sort = f"{group_url}?sorting_setting=CHRONOLOGICAL"
-                    await page.goto(url_with_sort, wait_until="domcontentloaded", timeout=15000)
+                    # "commit" returns as soon as the response starts, so parsing of the
+                    # page overlaps the wait for the first article below
+                    await page.goto(url_with_sort, wait_until="commit", timeout=15000)
                     logger.debug(f"[{group_name}] Navigation: {time.time() - nav_start:.1f}s")
                     
-                    # Wait for posts to appear (reduced timeout)
+                    # Wait for posts to appear (the only gate, no fixed delays)
                     wait_start = time.time()
                     try:
-                        await page.wait_for_selector('[role="article"]', timeout=5000)
+                        await page.wait_for_selector('[role="article"]', state="attached", timeout=15000)
                     except:
                         pass
                     logger.debug(f"[{group_name}] Wait for articles: {time.time() - wait_start:.1f}s")
                     
                     # Get actual group name from page (quick, no timeout issue)
                     try:
-                        h1 = await page.query_selector("h1")
-                        if h1:
-                            name = await h1.inner_text()
-                            if name:
-                                group_name = name.strip()
+                        name = await page.evaluate("() => document.querySelector('h1')?.innerText")
+                        if name:
+                            group_name = name.strip()
                     except:
                         pass
                     
@@ -393,59 +543,44 @@ class FacebookScraper:
                     max_scrolls = 30
                     consecutive_empty = 0
                     hit_processed = False
-                    parsed_count = 0
-                    
-                    # Initial wait for articles to load
-                    await asyncio.sleep(1)
                     
                     while posts_found < limit_per_group and scroll_attempts < max_scrolls and not hit_processed:
-                        # Get all articles currently on page
-                        articles = await page.query_selector_all('[role="article"]')
-                        new_articles = articles[parsed_count:]
+                        # Extract only NEW articles, all fields in one round-trip
+                        raw_posts = await page.evaluate(_EXTRACT_POSTS_JS)
                         
-                        # Parse only NEW articles
-                        for article in new_articles:
+                        for raw in raw_posts:
                             if posts_found >= limit_per_group or hit_processed:
                                 break
                             
-                            try:
-                                post = await self._parse_article_fast(page, article, group_id, group_name)
-                                if not post:
-                                    continue
-                                
-                                # Check if already processed - early stop
-                                if post.post_id in processed_ids:
-                                    logger.info(f"[{group_name}] Hit processed post, stopping")
-                                    hit_processed = True
-                                    break
-                                
-                                # Dedupe by text hash
-                                text_hash = hash(post.text[:100])
-                                if text_hash in seen_texts:
-                                    continue
-                                seen_texts.add(text_hash)
-                                
-                                posts.append(post)
-                                posts_found += 1
-                            except:
+                            post = self._build_post(raw, group_id, group_name)
+                            if not post:
                                 continue
-                        
-                        parsed_count = len(articles)
+                            
+                            # Check if already processed - early stop
+                            if post.post_id in processed_ids:
+                                logger.info(f"[{group_name}] Hit processed post, stopping")
+                                hit_processed = True
+                                break
+                            
+                            # Dedupe by text hash
+                            text_hash = _text_key(post.text)
+                            if text_hash in seen_texts:
+                                continue
+                            seen_texts.add(text_hash)
+                            
+                            posts.append(post)
+                            posts_found += 1
                         
                         # Stop conditions
                         if hit_processed or posts_found >= limit_per_group:
                             break
                         
                         # Scroll to load more
-                        prev_count = len(articles)
                         await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
                         
                         # Wait for new articles to appear (up to 10s)
                         try:
-                            await page.wait_for_function(
-                                f"document.querySelectorAll('[role=\"article\"]').length > {prev_count}",
-                                timeout=10000
-                            )
+                            await page.wait_for_selector(_UNSEEN_ARTICLE, state="attached", timeout=10000)
                             consecutive_empty = 0  # Reset on success
                         except:
                             # No new articles loaded
@@ -471,31 +606,32 @@ class FacebookScraper:
                     logger.error(f"[{group_name}] Error after {total_time:.1f}s: {e}")
                     return []
             
-            # Process in batches using workers
-            for batch_start in range(0, len(groups), len(pages)):
-                batch = groups[batch_start:batch_start + len(pages)]
-                batch_names = [g["name"][:20] for g in batch]
-                logger.info(f"Batch {batch_start//len(pages)+1}: {batch_names}")
-                
-                # Assign each group to a page with timeout
-                tasks = []
-                for i, group in enumerate(batch):
-                    page = pages[i % len(pages)]
-                    # Wrap each group scrape with 45s timeout (reduced from 60)
-                    task = asyncio.wait_for(scrape_group(page, group), timeout=45.0)
-                    tasks.append(task)
-                
-                # Run batch in parallel
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                
-                for idx, result in enumerate(batch_results):
-                    if isinstance(result, list):
-                        all_posts.extend(result)
-                    elif isinstance(result, asyncio.TimeoutError):
-                        group_name = batch[idx].get('name', 'unknown') if idx < len(batch) else 'unknown'
-                        logger.warning(f"TIMEOUT: {group_name} (45s)")
-                    elif isinstance(result, Exception):
-                        logger.error(f"Parallel scrape error: {result}")
+            # Each worker page pulls the next group as soon as it's free,
+            # so one slow group doesn't hold up the others
+            queue: asyncio.Queue = asyncio.Queue()
+            for group in groups:
+                queue.put_nowait(group)
+            
+            async def worker(page: Page):
+                while not queue.empty():
+                    group = queue.get_nowait()
+                    try:
+                        # Wrap each group scrape with 45s timeout
+                        posts = await asyncio.wait_for(scrape_group(page, group), timeout=45.0)
+                        all_posts.extend(posts)
+                    except asyncio.TimeoutError:
+                        logger.warning(f"TIMEOUT: {group.get('name', 'unknown')} (45s)")
+                        # The page may be stuck mid-navigation, reset it before the next group
+                        try:
+                            await page.goto("about:blank", timeout=5000)
+                        except Exception:
+                            pass
+                    except Exception as e:
+                        logger.error(f"Parallel scrape error: {e}")
+            
+            async with asyncio.TaskGroup() as tg:
+                for page in pages:
+                    tg.create_task(worker(page))
             
         finally:
             # Close worker pages
@@ -508,301 +644,66 @@ class FacebookScraper:
         logger.info(f"Parallel scraping complete: {len(all_posts)} total posts from {len(groups)} groups")
         return all_posts
     
-    async def _parse_article_fast(self, page: Page, article, group_id: str, group_name: str) -> Optional[ParsedPost]:
-        """Article parsing with 'See more' click but strict timeout to prevent hangs"""
-        # Check if this is a valid post (has post link)
-        post_url = ""
-        post_id = ""
-        try:
-            post_link = await article.query_selector('a[href*="/posts/"], a[href*="/permalink/"]')
-            if post_link:
-                href = await post_link.get_attribute("href")
-                if href:
-                    if "comment_id=" in href or "reply_comment_id=" in href:
-                        return None
-                    post_url = href if href.startswith("http") else f"https://www.facebook.com{href}"
-                    match = re.search(r'/posts/(\d+)', href) or re.search(r'/permalink/(\d+)', href)
-                    if match:
-                        post_id = match.group(1)
-        except:
-            pass
-        
-        if not post_url:
+    def _build_post(self, raw: dict, group_id: str, group_name: str) -> Optional[ParsedPost]:
+        """Build ParsedPost from raw fields returned by _EXTRACT_POSTS_JS"""
+        # Skip articles that don't have a post link (sidebars, ads, etc.)
+        href = raw.get("href")
+        if not href:
             return None
         
-        # Get author (quick)
-        author_name = "Unknown"
-        author_id = None
-        try:
-            for selector in ['h2 a[role="link"]', 'h3 a[role="link"]']:
-                author_link = await article.query_selector(selector)
-                if author_link:
-                    name = await author_link.inner_text()
-                    if name and len(name.strip()) > 1:
-                        author_name = name.strip()
-                        break
-        except:
-            pass
-        
-        # Click "See more" with STRICT timeout to get full text
-        try:
-            see_more = await article.query_selector('div[role="button"]:has-text("See more"), div[role="button"]:has-text("Ещё")')
-            if see_more:
-                # Use strict 1s timeout - if it hangs, skip this click
-                try:
-                    await asyncio.wait_for(see_more.click(), timeout=3.0)
-                    await asyncio.sleep(0.3)  # Wait for text to expand
-                except asyncio.TimeoutError:
-                    pass  # Click timed out, continue with truncated text
-        except:
-            pass
-        
-        # Get text (after expanding if successful)
-        text = ""
-        try:
-            text_divs = await article.query_selector_all('div[dir="auto"]')
-            for div in text_divs:
-                t = await div.inner_text()
-                if t and len(t) > 30 and t.strip() != author_name:
-                    text = t.strip()
-                    break
-        except:
-            pass
-        
-        if not text or len(text) < 10:
+        # Ignore comments and replies (also covers reply_comment_id=)
+        if "comment_id=" in href:
             return None
         
-        if not post_id:
-            post_id = str(abs(hash(text[:100])))
-        
-        return ParsedPost(
-            post_id=post_id,
-            group_id=group_id,
-            group_name=group_name,
-            author_name=author_name[:100],
-            author_id=author_id,
-            text=text[:2000],
-            timestamp=datetime.now(),
-            post_url=post_url
-        )
-    
-    async def _apply_stealth_to_page(self, page: Page):
-        """Apply stealth mode to a specific page"""
-        await page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-            Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3, 4, 5] });
-            Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en', 'ru'] });
-            window.chrome = { runtime: {} };
-        """)
-    
-    async def _parse_article_on_page(self, page: Page, article, group_id: str, group_name: str) -> Optional[ParsedPost]:
-        """Parse article using specific page context"""
-        # Reuse existing _parse_article logic but explicitly pass page context
-        # First check if this is a valid post (has post link)
-        post_url = ""
-        post_id = ""
-        try:
-            post_link = await article.query_selector('a[href*="/posts/"], a[href*="/permalink/"]')
-            if post_link:
-                href = await post_link.get_attribute("href")
-                if href:
-                    # Ignore comments and replies
-                    if "comment_id=" in href or "reply_comment_id=" in href:
-                         logger.debug(f"Ignoring comment post: {href}")
-                         return None
-                         
-                    post_url = href if href.startswith("http") else f"https://www.facebook.com{href}"
-                    match = re.search(r'/posts/(\d+)', href) or re.search(r'/permalink/(\d+)', href)
-                    if match:
-                        post_id = match.group(1)
-        except:
-            pass
+        # Drop the tracking query string (__cft__, __tn__), the path alone identifies the post
+        path = href.partition("?")[0]
+        post_url = path if path.startswith("http") else f"https://www.facebook.com{path}"
+        match = _POST_ID_RE.search(path)
+        post_id = match.group(1) if match else ""
         
-        if not post_url:
+        text = raw.get("text") or ""
+        if len(text) < 10:
             return None
         
-        # Get author
-        author_name = "Unknown"
-        author_id = None
-        try:
-            author_selectors = ['h2 a[role="link"]', 'h3 a[role="link"]', 'a[role="link"] strong']
-            for selector in author_selectors:
-                author_link = await article.query_selector(selector)
-                if author_link:
-                    name = await author_link.inner_text()
-                    if name and len(name.strip()) > 1:
-                        author_name = name.strip()
-                        break
-        except:
-            pass
-        
-        # Click "See more" / "Ещё" to expand text (with timeout to prevent hang)
-        try:
-            see_more_selectors = [
-                'div[role="button"]:has-text("See more")',
-                'div[role="button"]:has-text("Ещё")',
-                'div[role="button"]:has-text("Показать ещё")',
-            ]
-            for selector in see_more_selectors:
-                see_more = await article.query_selector(selector)
-                if see_more:
-                    # Use timeout to prevent click from hanging
-                    try:
-                        await asyncio.wait_for(see_more.click(), timeout=2.0)
-                    except asyncio.TimeoutError:
-                        pass  # Click timed out, continue anyway
-                    break
-        except:
-            pass
-        
-        # Get text (after expanding)
-        text = ""
-        try:
-            text_divs = await article.query_selector_all('div[dir="auto"]')
-            for div in text_divs:
-                t = await div.inner_text()
-                if t and len(t) > 30 and t.strip() != author_name:
-                    text = t.strip()
-                    break
-        except:
-            pass
-        
-        if not text or len(text) < 10:
-            return None
+        author_name = raw.get("author") or "Unknown"
+        author_id = raw.get("author_id")
         
         if not post_id:
-            post_id = str(abs(hash(text[:100])))
+            # Generate ID from text hash (stable across restarts, so it matches processed_ids).
+            # 128 bits over a longer prefix than the dedupe key: IDs are stored for good
+            post_id = hashlib.blake2b(text[:500].encode("utf-8", "ignore"), digest_size=16).hexdigest()
         
+        # Timestamp - use current time (parsing FB dates is unreliable)
         return ParsedPost(
             post_id=post_id,
             group_id=group_id,
             group_name=group_name,
-            author_name=author_name[:100],
+            author_name=author_name,
             author_id=author_id,
-            text=text[:2000],
+            text=text,
             timestamp=datetime.now(),
             post_url=post_url
         )
-
+    
+    async def _block_heavy_resources(self, page: Page):
+        """Block photos, video, fonts and the tracking pixel on a worker page to cut load time"""
+        cdp = await self.context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": _BLOCKED_URL_PATTERNS})
+    
     async def _get_group_name(self) -> str:
         """Extract group name from current page"""
         try:
             # Try h1 first
-            h1 = await self.page.query_selector("h1")
-            if h1:
-                name = await h1.inner_text()
-                if name:
-                    return name.strip()
+            name = await self.page.evaluate("() => document.querySelector('h1')?.innerText")
+            if name:
+                return name.strip()
             
             # Fallback to title
             title = await self.page.title()
             return title.split("|")[0].strip() if title else "Unknown Group"
         except:
             return "Unknown Group"
-    
-    async def _parse_article(self, article, group_id: str, group_name: str) -> Optional[ParsedPost]:
-        """Parse a single post article element"""
-        
-        # First check if this is a valid post (has post link)
-        post_url = ""
-        post_id = ""
-        try:
-            # Links to posts contain /posts/ or /permalink/
-            post_link = await article.query_selector('a[href*="/posts/"], a[href*="/permalink/"]')
-            if post_link:
-                href = await post_link.get_attribute("href")
-                if href:
-                    post_url = href if href.startswith("http") else f"https://www.facebook.com{href}"
-                    # Extract post ID
-                    match = re.search(r'/posts/(\d+)', href) or re.search(r'/permalink/(\d+)', href)
-                    if match:
-                        post_id = match.group(1)
-        except:
-            pass
-        
-        # Skip articles that don't have a post link (sidebars, ads, etc.)
-        if not post_url:
-            return None
-        
-        # Try to click "See more" if present
-        try:
-            see_more = await article.query_selector('[role="button"]:has-text("See more"), [role="button"]:has-text("Ещё"), [role="button"]:has-text("Показать ещё")')
-            if see_more:
-                await see_more.click()
-                await asyncio.sleep(0.3)
-        except:
-            pass
-        
-        # Get author info - look for bold text in header or profile links
-        author_name = "Unknown"
-        author_id = None
-        try:
-            # Try multiple selectors for author
-            author_selectors = [
-                'h2 a[role="link"]',  # Header link
-                'h3 a[role="link"]',  # Alternative header
-                'a[role="link"] strong',  # Bold link text
-                'span[dir="auto"] > a[role="link"]',  # Span-wrapped link
-            ]
-            for selector in author_selectors:
-                author_link = await article.query_selector(selector)
-                if author_link:
-                    name = await author_link.inner_text()
-                    if name and len(name.strip()) > 1:
-                        author_name = name.strip()
-                        break
-            
-            # Try to get author ID from profile link
-            profile_link = await article.query_selector('a[href*="/user/"], a[href*="/profile.php"]')
-            if profile_link:
-                href = await profile_link.get_attribute("href")
-                if href:
-                    match = re.search(r'/user/(\d+)', href)
-                    if match:
-                        author_id = match.group(1)
-        except:
-            pass
-        
-        # Get text content - filter out short metadata
-        text = ""
-        try:
-            text_divs = await article.query_selector_all('div[dir="auto"]')
-            texts = []
-            for div in text_divs:
-                t = await div.inner_text()
-                # Skip short text (buttons, timestamps, etc.)
-                if t and len(t) > 30:
-                    # Skip if it's just the author name
-                    if t.strip() == author_name:
-                        continue
-                    texts.append(t.strip())
-            
-            # Take first substantive text block
-            if texts:
-                text = texts[0]
-        except:
-            pass
-        
-        if not text or len(text) < 10:
-            return None
-        
-        if not post_id:
-            # Generate ID from text hash
-            post_id = str(abs(hash(text[:100])))
-        
-        # Timestamp - use current time (parsing FB dates is unreliable)
-        timestamp = datetime.now()
-        
-        return ParsedPost(
-            post_id=post_id,
-            group_id=group_id,
-            group_name=group_name,
-            author_name=author_name[:100],
-            author_id=author_id,
-            text=text[:2000],
-            timestamp=timestamp,
-            post_url=post_url
-        )
 
 
 async def test_scraper():
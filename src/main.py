@@ -1,24 +1,38 @@
 import asyncio
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from src.config import config
 from src.db.models import init_db
 from src.db.repository import Repository
-from src.processing.analyzer import analyze_messages_batch
+from src.processing.analyzer import analyze_messages_batch, close_llm_client
+from src.processing.dedup import deduplicate
 from src.processing.filter import filter_messages
 from src.telegram.bot import NotificationBot
 from src.telegram.userbot import UserBot
 from src.utils.logger import logger
 
+# Feeds are scraped newest first, so the early-stop check only ever meets recently
+# processed posts; older IDs are left in the DB instead of being held in memory
+PROCESSED_IDS_WINDOW = timedelta(days=30)
+
+
+def get_peer_chat_id(peer) -> int:
+    """Extract chat_id for DB state tracking (handle both peer refs and entities)"""
+    if hasattr(peer, "channel_id"):
+        return peer.channel_id
+    if hasattr(peer, "chat_id"):
+        return peer.chat_id
+    return peer.id  # Direct entity object
+
 
 async def process_cycle(userbot: UserBot, bot: NotificationBot, prompt_type: str = "property"):
     """One processing cycle (runs every N minutes)"""
     logger.info("=" * 50)
     logger.info(f"Starting processing cycle (prompt_type={prompt_type})")
 
-    repo = Repository()
     total_messages = 0
     filtered_messages = []
     leads_found = 0
@@ -34,43 +48,37 @@ async def process_cycle(userbot: UserBot, bot: NotificationBot, prompt_type: str
         # 2. Collect new messages from all chats
         all_messages = []
         chats_to_update = []  # Store (chat_id, max_msg_id) for update after successful analysis
-        
-        for peer in peers:
-        # Extract chat_id for DB state tracking (handle both peer refs and entities)
-            if hasattr(peer, "channel_id"):
-                chat_id = peer.channel_id
-            elif hasattr(peer, "chat_id"):
-                chat_id = peer.chat_id
-            else:
-                chat_id = peer.id  # Direct entity object
-            
-            min_id = repo.get_last_message_id(chat_id)
-            
+    
+        # Load last message ids for all chats in one query
+        peer_chat_ids = [(peer, get_peer_chat_id(peer)) for peer in peers]
+        with Repository() as repo:
+            last_message_ids = repo.preload_chat_states([chat_id for _, chat_id in peer_chat_ids])
+    
+        # Fetch all chats concurrently; new chat (no state yet) - from the start, cut to last 24h below
+        fetched = await userbot.get_new_messages_many(
+            [(peer, last_message_ids.get(chat_id, 0)) for peer, chat_id in peer_chat_ids]
+        )
+        new_chat_cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
+
+        for (peer, chat_id), messages in zip(peer_chat_ids, fetched):
+            if not messages:
+                continue
+
+            max_msg_id = max(m.message_id for m in messages)
+            chats_to_update.append((chat_id, max_msg_id))
+
             # New chat - get messages from last 24 hours for analysis
-            if min_id is None:
-                messages = await userbot.get_new_messages(peer, min_id=0)
-                if messages:
-                    # Filter to last 24 hours
-                    from datetime import datetime, timedelta, timezone
-                    cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
-                    recent_messages = [m for m in messages if m.date.replace(tzinfo=timezone.utc) > cutoff]
-                    
-                    max_msg_id = max(m.message_id for m in messages)
-                    chats_to_update.append((chat_id, max_msg_id))
-                    
-                    if recent_messages:
-                        all_messages.extend(recent_messages)
-                        logger.info(f"New chat {chat_id}: analyzing {len(recent_messages)} messages from last 24h")
-                    else:
-                        logger.info(f"New chat {chat_id}: no messages in last 24h")
+            if chat_id not in last_message_ids:
+                recent_messages = [m for m in messages if m.date.replace(tzinfo=timezone.utc) > new_chat_cutoff]
+
+                if recent_messages:
+                    all_messages.extend(recent_messages)
+                    logger.info(f"New chat {chat_id}: analyzing {len(recent_messages)} messages from last 24h")
+                else:
+                    logger.info(f"New chat {chat_id}: no messages in last 24h")
                 continue
-            
-            messages = await userbot.get_new_messages(peer, min_id)
 
-            if messages:
-                max_msg_id = max(m.message_id for m in messages)
-                chats_to_update.append((chat_id, max_msg_id))
-                all_messages.extend(messages)
+            all_messages.extend(messages)
 
         total_messages = len(all_messages)
         logger.info(f"Fetched {total_messages} new messages from {len(peers)} chats")
@@ -81,35 +89,12 @@ async def process_cycle(userbot: UserBot, bot: NotificationBot, prompt_type: str
 
         # 3. Filter messages
         filtered = filter_messages(all_messages)
-        
-        # Deduplicate by exact text match
-        seen_texts = set()
-        deduplicated = []
-        for msg in filtered:
-            if msg.text not in seen_texts:
-                seen_texts.add(msg.text)
-                deduplicated.append(msg)
-        
+    
+        # Deduplicate reposts (text equal up to case, punctuation, emoji and spacing)
+        deduplicated = deduplicate(filtered, lambda msg: msg.text)
+    
         logger.info(f"After deduplication: {len(deduplicated)} unique texts (was {len(filtered)})")
-        filtered = deduplicated
-        
-        filtered_messages = []
-
-        # Save filtered messages to DB
-        for msg in filtered:
-            user = repo.get_or_create_user(msg.user_id, msg.username, msg.first_name)
-            db_msg = repo.save_message(
-                telegram_message_id=msg.message_id,
-                chat_id=msg.chat_id,
-                chat_title=msg.chat_title,
-                chat_username=msg.chat_username,
-                user=user,
-                text=msg.text,
-                created_at=msg.date,
-            )
-            filtered_messages.append((msg, db_msg, user))
-
-        logger.info(f"Saved {len(filtered_messages)} messages to DB")
+        filtered_messages = deduplicated
 
         if not filtered_messages:
             await bot.send_stats(total_messages, 0, 0, 0)
@@ -120,82 +105,108 @@ async def process_cycle(userbot: UserBot, bot: NotificationBot, prompt_type: str
             if msg.reply_to_text:
                 return f'(↩ "{msg.reply_to_text}") {msg.text}'
             return msg.text
-        
+    
         # Include user_id so LLM can group messages from same person
         texts_to_analyze = [
             (i, msg.user_id, format_text_for_analysis(msg)) 
-            for i, (msg, _, _) in enumerate(filtered_messages)
+            for i, msg in enumerate(filtered_messages)
         ]
         analysis_results, analysis_success = await analyze_messages_batch(texts_to_analyze, prompt_type=prompt_type)
 
         if not analysis_success:
-            logger.warning("Analysis incomplete due to errors, messages NOT marked as analyzed")
+            logger.warning("Analysis incomplete due to errors, messages NOT saved")
             await bot.send_stats(total_messages, len(filtered_messages), 0, 0)
             return
 
-        # 5. Process results and collect leads (only if analysis succeeded)
+        # 5. Save messages with analysis results and advance chat states (only after
+        # successful analysis) in one short transaction, committed before any lead is
+        # sent: a later notification failure then can't roll back and resend the leads
         leads_list = []
-        for i, (msg, db_msg, user) in enumerate(filtered_messages):
-            result = analysis_results.get(i)
-            if not result:
-                continue
-            
-            is_lead, reason, confidence, lead_type = result
-            repo.update_message_lead_status(db_msg.id, is_lead, confidence, reason)
-
-            if is_lead:
-                leads_found += 1
-                # Use IT emoji for it_services
-                if lead_type == "it_services":
-                    emoji = "💻"
-                elif lead_type == "vehicle":
-                    emoji = "🚗"
-                else:
-                    emoji = "🏠"
-                logger.info(f"{emoji} Lead found: user={msg.user_id}, type={lead_type}, confidence={confidence:.0%}")
+        message_rows = []
+        analyzed_at = datetime.utcnow()
+        with Repository() as repo:
+            user_ids = repo.get_or_create_users_bulk(
+                [(msg.user_id, msg.username, msg.first_name) for msg in filtered_messages]
+            )
+            for i, msg in enumerate(filtered_messages):
+                result = analysis_results.get(i)
+                row = {
+                    "telegram_message_id": msg.message_id,
+                    "chat_id": msg.chat_id,
+                    "chat_title": msg.chat_title,
+                    "chat_username": msg.chat_username,
+                    "user_id": user_ids[msg.user_id],
+                    "text": msg.text,
+                    "created_at": msg.date,
+                    "source": "telegram",
+                    "is_lead": None,
+                    "confidence": None,
+                    "reason": None,
+                    "analyzed_at": None,
+                }
+                message_rows.append(row)
+
+                if not result:
+                    continue
+        
+                is_lead, reason, confidence, lead_type = result
+                # reason is VARCHAR(500); LLM output is not length-bounded and may be null
+                row.update(is_lead=is_lead, confidence=confidence, reason=(reason or "")[:500], analyzed_at=analyzed_at)
+
+                if is_lead:
+                    leads_found += 1
+                    # Use IT emoji for it_services
+                    if lead_type == "it_services":
+                        emoji = "💻"
+                    elif lead_type == "vehicle":
+                        emoji = "🚗"
+                    else:
+                        emoji = "🏠"
+                    logger.info(f"{emoji} Lead found: user={msg.user_id}, type={lead_type}, confidence={confidence:.0%}")
 
-                # Format contact
-                if msg.username:
-                    contact = f"@{msg.username}"
-                else:
-                    from src.telegram.bot import escape_markdown
-                    name = msg.first_name or "Пользователь"
-                    contact = f"[{escape_markdown(name)}](tg://user?id={msg.user_id})"
-                
-                # Format chat link
-                if msg.chat_username:
-                    if msg.topic_id:
-                        msg_link = f"https://t.me/{msg.chat_username}/{msg.topic_id}/{msg.message_id}"
+                    # Format contact
+                    if msg.username:
+                        contact = f"@{msg.username}"
                     else:
-                        msg_link = f"https://t.me/{msg.chat_username}/{msg.message_id}"
-                else:
-                    chat_id_positive = abs(msg.chat_id) % (10**10)
-                    if msg.topic_id:
-                        msg_link = f"https://t.me/c/{chat_id_positive}/{msg.topic_id}/{msg.message_id}"
+                        from src.telegram.bot import escape_markdown
+                        name = msg.first_name or "Пользователь"
+                        contact = f"[{escape_markdown(name)}](tg://user?id={msg.user_id})"
+            
+                    # Format chat link
+                    if msg.chat_username:
+                        if msg.topic_id:
+                            msg_link = f"https://t.me/{msg.chat_username}/{msg.topic_id}/{msg.message_id}"
+                        else:
+                            msg_link = f"https://t.me/{msg.chat_username}/{msg.message_id}"
                     else:
-                        msg_link = f"https://t.me/c/{chat_id_positive}/{msg.message_id}"
-                
-                from src.telegram.bot import escape_markdown
-                chat_title_safe = escape_markdown(msg.chat_title or 'Чат')
-                chat_link = f"[{chat_title_safe}]({msg_link})"
-                
-                leads_list.append({
-                    "contact": contact,
-                    "chat_link": chat_link,
-                    "text": msg.text,
-                    "confidence": confidence,
-                    "reason": reason,
-                    "lead_type": lead_type,
-                })
-        
-        # Send all leads in one message
+                        chat_id_positive = abs(msg.chat_id) % (10**10)
+                        if msg.topic_id:
+                            msg_link = f"https://t.me/c/{chat_id_positive}/{msg.topic_id}/{msg.message_id}"
+                        else:
+                            msg_link = f"https://t.me/c/{chat_id_positive}/{msg.message_id}"
+            
+                    from src.telegram.bot import escape_markdown
+                    chat_title_safe = escape_markdown(msg.chat_title or 'Чат')
+                    chat_link = f"[{chat_title_safe}]({msg_link})"
+            
+                    leads_list.append({
+                        "contact": contact,
+                        "chat_link": chat_link,
+                        "text": msg.text,
+                        "confidence": confidence,
+                        "reason": reason,
+                        "lead_type": lead_type,
+                    })
+    
+            repo.save_messages_bulk(message_rows)
+            for chat_id, max_msg_id in chats_to_update:
+                repo.update_last_message_id(chat_id, max_msg_id)
+        logger.info(f"Saved {len(message_rows)} messages to DB")
+
+        # 6. Send all leads in one message
         if leads_list:
             await bot.send_leads_batch(leads_list, source="telegram")
 
-        # 6. Update chat states (only after successful analysis)
-        for chat_id, max_msg_id in chats_to_update:
-            repo.update_last_message_id(chat_id, max_msg_id)
-
         # 7. Send stats
         await bot.send_stats(
             total=total_messages,
@@ -208,8 +219,19 @@ async def process_cycle(userbot: UserBot, bot: NotificationBot, prompt_type: str
 
     except Exception as e:
         logger.error(f"Processing cycle error: {e}", exc_info=True)
-    finally:
-        repo.close()
+
+
+def load_processed_post_ids() -> set[str]:
+    """
+    Load Facebook post IDs processed within PROCESSED_IDS_WINDOW. Blocking, run via
+    asyncio.to_thread(): the worker thread gets its own scoped session.
+    """
+    try:
+        with Repository() as repo:
+            return repo.get_processed_post_ids(since=datetime.utcnow() - PROCESSED_IDS_WINDOW)
+    except Exception as e:
+        logger.warning(f"Could not load processed IDs: {e}")
+        return set()
 
 
 async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type: str = "property"):
@@ -219,32 +241,32 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
     logger.info("=" * 50)
     logger.info(f"Starting Facebook processing cycle (prompt_type={prompt_type})")
 
-    repo = Repository()
     total_posts = 0
     filtered_posts = []
     leads_found = 0
     scan_start_time = datetime.now()
 
     try:
+        # Load processed post IDs (early-stop check) in a worker thread while groups are fetched
+        processed_ids_task = asyncio.create_task(asyncio.to_thread(load_processed_post_ids))
+
         # 1. Get all user's groups
-        groups = await fb_scraper.get_user_groups()
+        try:
+            groups = await fb_scraper.get_user_groups()
+        except BaseException:
+            processed_ids_task.cancel()
+            raise
         if not groups:
+            processed_ids_task.cancel()  # Nothing to scan, don't leave the load unawaited
             logger.warning("No Facebook groups found")
             await bot.send_stats(0, 0, 0, 0, source="facebook")
             return
 
         logger.info(f"Found {len(groups)} Facebook groups")
 
-        # Get all processed post IDs for early-stop check
-        from src.db.models import FacebookProcessedPost
-        processed_ids = set()
-        try:
-            processed_posts = repo.session.query(FacebookProcessedPost.post_id).all()
-            processed_ids = {p.post_id for p in processed_posts}
-            logger.info(f"Loaded {len(processed_ids)} already-processed post IDs")
-        except Exception as e:
-            logger.warning(f"Could not load processed IDs: {e}")
-        
+        processed_ids = await processed_ids_task
+        logger.info(f"Loaded {len(processed_ids)} already-processed post IDs")
+    
         # TEST_MODE: 1 worker, 3 groups limit
         import os
         max_workers = 3
@@ -260,7 +282,7 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
             max_workers=max_workers,
             processed_ids=processed_ids
         )
-        
+    
         # Track scanned groups
         groups_scanned = [(g["id"], g["name"]) for g in groups]
 
@@ -271,38 +293,34 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
             await bot.send_stats(0, 0, 0, 0, source="facebook")
             return
 
-        # 3. Filter out already processed posts (by post_id) with colored logging
-        from src.utils.logger import log_new_post, log_old_post
-        
-        new_posts = []
-        for post in all_posts:
-            if not repo.is_facebook_post_processed(post.post_id):
-                new_posts.append(post)
-                log_new_post(post.text, source="FB")
-            else:
-                log_old_post(post.post_id, source="FB")
-        
-        logger.info(f"New posts: {len(new_posts)} / {total_posts}")
-        
+        # 3. Filter out already processed posts (by post_id).
+        # processed_ids covers recent posts; the rest are checked in one query
+        with Repository() as repo:
+            processed_ids |= repo.find_processed_post_ids(
+                [post.post_id for post in all_posts if post.post_id not in processed_ids]
+            )
+        new_posts = [post for post in all_posts if post.post_id not in processed_ids]
+    
+        logger.info(f"New posts: {len(new_posts)} / {total_posts} ({total_posts - len(new_posts)} already processed)")
+    
         if not new_posts:
             await bot.send_stats(total_posts, 0, 0, 0, source="facebook")
             return
 
-        # 4. Filter posts (exclude words) and track per-group counts
-        filtered_posts = []
-        posts_per_group = {}  # group_name -> count
-        for post in new_posts:
-            text_lower = post.text.lower()
-            excluded = any(word in text_lower for word in config.exclude_words)
-            if not excluded:
-                filtered_posts.append(post)
-                posts_per_group[post.group_name] = posts_per_group.get(post.group_name, 0) + 1
+        # 4. Filter posts (exclude words, reposts) and track per-group counts
+        exclude_re = config.exclude_re
+        filtered_posts = [
+            post for post in deduplicate(new_posts, lambda post: post.text)
+            if exclude_re is None or not exclude_re.search(post.text)
+        ]
+        posts_per_group = Counter(post.group_name for post in filtered_posts)  # group_name -> count
 
         logger.info(f"After exclude words filter: {len(filtered_posts)} posts")
 
         if not filtered_posts:
             # Mark all new posts as processed even if filtered out
-            repo.mark_facebook_posts_batch([(p.post_id, p.group_id) for p in new_posts])
+            with Repository() as repo:
+                repo.mark_facebook_posts_batch([(p.post_id, p.group_id) for p in new_posts])
             await bot.send_stats(total_posts, 0, 0, 0, source="facebook")
             return
 
@@ -317,17 +335,17 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
 
         # 6. Process results and collect leads
         leads_list = []
-        leads_per_group = {}  # group_name -> count
+        leads_per_group = Counter()  # group_name -> count
         for i, post in enumerate(filtered_posts):
             result = analysis_results.get(i)
             if not result:
                 continue
-            
+        
             is_lead, reason, confidence, lead_type = result
 
             if is_lead:
                 leads_found += 1
-                leads_per_group[post.group_name] = leads_per_group.get(post.group_name, 0) + 1
+                leads_per_group[post.group_name] += 1
                 # Use IT emoji for it_services
                 if lead_type == "it_services":
                     emoji = "💻"
@@ -337,16 +355,17 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
                     emoji = "🏠"
                 logger.info(f"{emoji} FB Lead: author={post.author_name}, type={lead_type}, confidence={confidence:.0%}")
 
+                from src.telegram.bot import escape_markdown
+
                 # Format contact
                 if post.author_id:
-                    contact = f"[{post.author_name}](https://facebook.com/profile.php?id={post.author_id})"
+                    contact = f"[{escape_markdown(post.author_name)}](https://facebook.com/profile.php?id={post.author_id})"
                 else:
-                    contact = post.author_name
-                
+                    contact = escape_markdown(post.author_name)
+            
                 # Format chat link
-                from src.telegram.bot import escape_markdown
                 chat_link = f"[{escape_markdown(post.group_name[:40])}]({post.post_url})"
-                
+            
                 leads_list.append({
                     "contact": contact,
                     "chat_link": chat_link,
@@ -356,18 +375,18 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
                     "lead_type": lead_type,
                 })
 
-        # 7. Send leads in one batch message
+        # 7. Mark all new posts as processed and update group states (after successful
+        # analysis), committed before the leads are sent so they can't be sent twice
+        with Repository() as repo:
+            repo.mark_facebook_posts_batch([(p.post_id, p.group_id) for p in new_posts])
+            for group_id, group_name in groups_scanned:
+                repo.update_facebook_group_state(group_id, group_name, scan_start_time)
+
+        # 8. Send leads in one batch message
         if leads_list:
             await bot.send_leads_batch(leads_list, source="facebook")
 
-        # 8. Mark all new posts as processed (after successful analysis)
-        repo.mark_facebook_posts_batch([(p.post_id, p.group_id) for p in new_posts])
-
-        # 9. Update group states
-        for group_id, group_name in groups_scanned:
-            repo.update_facebook_group_state(group_id, group_name, scan_start_time)
-
-        # 10. Send stats with groups count
+        # 9. Send stats with groups count
         await bot.send_stats(
             total=total_posts,
             filtered=len(filtered_posts),
@@ -376,16 +395,14 @@ async def process_facebook_cycle(fb_scraper, bot: NotificationBot, prompt_type:
             source="facebook",
             groups_count=len(groups_scanned),
         )
-        
-        # 11. Send per-group breakdown
+    
+        # 10. Send per-group breakdown
         await bot.send_group_breakdown(posts_per_group, leads_per_group)
 
         logger.info(f"Facebook cycle complete: total={total_posts}, new={len(new_posts)}, filtered={len(filtered_posts)}, leads={leads_found}")
 
     except Exception as e:
         logger.error(f"Facebook processing cycle error: {e}", exc_info=True)
-    finally:
-        repo.close()
 
 
 async def main():
@@ -448,13 +465,10 @@ async def main():
 
     # Reset callback
     async def reset_chat_states():
-        repo = Repository()
-        try:
+        with Repository() as repo:
             count = repo.reset_telegram_chat_states()
-            logger.info(f"Reset {count} chat states via /reset command")
-            return count
-        finally:
-            repo.close()
+        logger.info(f"Reset {count} chat states via /reset command")
+        return count
 
     bot.set_reset_callback(reset_chat_states)
 
@@ -497,6 +511,7 @@ async def main():
         await userbot.stop()
         if fb_scraper:
             await fb_scraper.stop()
+        await close_llm_client()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 import asyncio
-import json
+import re
 
 import httpx
+import orjson
 
 from src.config import config
 from src.processing.prompts import BATCH_PROMPT, IT_SERVICES_PROMPT
@@ -12,6 +13,20 @@ if config.llm_provider == "gemini":
     import google.generativeai as genai
     genai.configure(api_key=config.gemini_api_key)
 
+# "Please retry in 37.5s" hint in rate limit errors
+_RETRY_RE = re.compile(r'retry in (\d+)', re.IGNORECASE)
+
+# Prompt templates pre-split around {messages}: per batch only a concatenation is needed
+_PROMPT_PARTS = {
+    prompt_type: tuple(template.format(messages="\0").split("\0"))
+    for prompt_type, template in (("property", BATCH_PROMPT), ("it_services", IT_SERVICES_PROMPT))
+}
+
+# Default number of parallel LLM calls per analyze_messages_batch() run
+LLM_MAX_PARALLEL = 3
+
+# Shared OpenRouter client: keeps connections alive across batches and cycles
+_openrouter_client: httpx.AsyncClient | None = None
 
 
 class AnalysisError(Exception):
@@ -30,24 +45,46 @@ async def call_gemini(prompt: str) -> str:
     return response.text.strip()
 
 
-async def call_openrouter(prompt: str) -> str:
-    """Call OpenRouter API"""
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
+def _get_openrouter_client() -> httpx.AsyncClient:
+    """Create the shared OpenRouter client on first use"""
+    global _openrouter_client
+    if _openrouter_client is None:
+        _openrouter_client = httpx.AsyncClient(
+            timeout=120.0,
             headers={
                 "Authorization": f"Bearer {config.openrouter_api_key}",
                 "Content-Type": "application/json",
             },
-            json={
-                "model": config.openrouter_model,
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.1,
-            },
+            # Telegram and Facebook cycles may analyze at the same time, LLM_MAX_PARALLEL calls each
+            limits=httpx.Limits(
+                max_connections=2 * LLM_MAX_PARALLEL, max_keepalive_connections=2 * LLM_MAX_PARALLEL
+            ),
         )
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"].strip()
+    return _openrouter_client
+
+
+async def close_llm_client():
+    """Close the shared OpenRouter client (call on shutdown)"""
+    global _openrouter_client
+    if _openrouter_client is not None:
+        await _openrouter_client.aclose()
+        _openrouter_client = None
+
+
+async def call_openrouter(prompt: str) -> str:
+    """Call OpenRouter API"""
+    client = _get_openrouter_client()
+    response = await client.post(
+        "https://openrouter.ai/api/v1/chat/completions",
+        content=orjson.dumps({
+            "model": config.openrouter_model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.1,
+        }),
+    )
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    return data["choices"][0]["message"]["content"].strip()
 
 
 async def call_llm(prompt: str) -> str:
@@ -66,6 +103,16 @@ def parse_response(result_text: str) -> list[dict]:
     if not text:
         return []
     
+    # Fast path for the usual shapes: a bare array or a single ```json block
+    candidate = text
+    if candidate.startswith("```"):
+        candidate = candidate[candidate.find("\n") + 1:candidate.rfind("```")].strip()
+    if candidate.startswith("["):
+        try:
+            return orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            pass  # Extra text around the array, use the general path below
+    
     # Remove markdown code blocks
     if "```" in text:
         parts = text.split("```")
@@ -85,8 +132,8 @@ def parse_response(result_text: str) -> list[dict]:
     
     # Parse JSON, return empty on failure
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
         return []
 
 
@@ -99,29 +146,16 @@ async def analyze_batch(messages: list[tuple[int, str]], max_retries: int = 3, p
     if not messages:
         return {}
 
-    # Format messages for prompt - support both (idx, text) and (idx, user_id, text) formats
-    formatted_lines = []
-    for item in messages:
-        if len(item) == 3:
-            idx, user_id, text = item
-            formatted_lines.append(f"[{idx}] (user:{user_id}) {text}")
-        else:
-            idx, text = item
-            formatted_lines.append(f"[{idx}] {text}")
-    
-    formatted = "\n\n".join(formatted_lines)
+    # Format messages for prompt and log them in one pass -
+    # support both (idx, text) and (idx, user_id, text) formats
+    lines = []
+    for idx, *user_id, text in messages:
+        log_text_preview(idx, text)
+        lines.append(f"[{idx}] (user:{user_id[0]}) {text}" if user_id else f"[{idx}] {text}")
     
     # Select prompt based on type
-    if prompt_type == "it_services":
-        prompt = IT_SERVICES_PROMPT.format(messages=formatted)
-    else:
-        prompt = BATCH_PROMPT.format(messages=formatted)
-    
-    # Log texts being analyzed
-    for item in messages:
-        idx = item[0]
-        text = item[-1]  # Last element is always text
-        log_text_preview(idx, text)
+    prefix, suffix = _PROMPT_PARTS.get(prompt_type, _PROMPT_PARTS["property"])
+    prompt = prefix + "\n\n".join(lines) + suffix
 
     for attempt in range(max_retries):
         try:
@@ -149,14 +183,9 @@ async def analyze_batch(messages: list[tuple[int, str]], max_retries: int = 3, p
             # Check for rate limit error
             if "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
                 wait_time = 60
-                if "retry in" in error_str.lower():
-                    try:
-                        import re
-                        match = re.search(r'retry in (\d+)', error_str.lower())
-                        if match:
-                            wait_time = int(match.group(1)) + 5
-                    except:
-                        pass
+                match = _RETRY_RE.search(error_str)
+                if match:
+                    wait_time = int(match.group(1)) + 5
                 
                 if attempt < max_retries - 1:
                     logger.warning(f"Rate limit hit, waiting {wait_time}s (attempt {attempt + 1}/{max_retries})")
@@ -172,7 +201,7 @@ async def analyze_batch(messages: list[tuple[int, str]], max_retries: int = 3, p
 async def analyze_messages_batch(
     texts: list[tuple[int, str]], 
     batch_size: int = 100,
-    max_parallel: int = 3,
+    max_parallel: int = LLM_MAX_PARALLEL,
     prompt_type: str = "property"
 ) -> tuple[dict[int, tuple[bool, str, float]], bool]:
     """
@@ -184,9 +213,11 @@ async def analyze_messages_batch(
         max_parallel: Number of parallel LLM calls
     
     Returns:
-        Tuple of (results dict, success bool)
+        Tuple of (results dict, success bool). success is False if any batch failed:
+        callers then skip saving, so the messages are retried next cycle.
     """
     all_results = {}
+    success = True
     
     # Split into batches
     batches = []
@@ -214,7 +245,12 @@ async def analyze_messages_batch(
                 all_results.update(result)
             elif isinstance(result, Exception):
                 logger.error(f"Batch {batch_num} failed: {result}")
-                # Continue with other batches instead of stopping
+                success = False
+        
+        # The cycle is retried as a whole, so don't spend API calls on the remaining groups
+        if not success:
+            logger.warning(f"Skipping remaining {total_batches - group_start - len(group)} batches after failure")
+            break
     
     log_analysis_result(len(texts), len(all_results))
-    return all_results, True
+    return all_results, success
@@ -0,0 +1,28 @@
+import re
+from collections.abc import Callable
+from typing import TypeVar
+
+T = TypeVar("T")
+
+# Anything but letters and digits: punctuation, emoji, whitespace
+_NOISE_RE = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """Dedupe key: lowercase text without punctuation, emoji and whitespace"""
+    return _NOISE_RE.sub("", text.lower()) or text  # emoji-only texts stay distinct
+
+
+def deduplicate(items: list[T], get_text: Callable[[T], str]) -> list[T]:
+    """
+    Keep the first of items whose texts differ only in case, punctuation,
+    emoji or spacing (reposted spam), so each is sent to the LLM once.
+    """
+    seen = set()
+    unique = []
+    for item in items:
+        key = normalize_text(get_text(item))
+        if key not in seen:
+            seen.add(key)
+            unique.append(item)
+    return unique
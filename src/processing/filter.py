@@ -8,21 +8,20 @@ def filter_messages(messages: list[ParsedMessage]) -> list[ParsedMessage]:
     Filter messages by exclude words.
     All users' messages are analyzed (no user deduplication).
     """
-    filtered = []
+    exclude_re = config.exclude_re
+    if exclude_re is None:
+        return list(messages)
 
+    # IGNORECASE search on the original text, no lowercased copy per message.
+    # Forwards and reposts repeat the same text: scan each distinct text once
+    keep = {}
+    filtered = []
     for msg in messages:
-        text_lower = msg.text.lower()
-
-        # Check exclude words
-        excluded = False
-        for word in config.exclude_words:
-            if word in text_lower:
-                excluded = True
-                break
-
-        if not excluded:
+        keep_msg = keep.get(msg.text)
+        if keep_msg is None:
+            keep_msg = keep[msg.text] = not exclude_re.search(msg.text)
+        if keep_msg:
             filtered.append(msg)
 
     logger.info(f"Filtered {len(messages)} -> {len(filtered)} messages")
     return filtered
-
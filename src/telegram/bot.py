@@ -1,33 +1,102 @@
 import asyncio
+import functools
+import re
 from datetime import datetime
 from typing import Callable
 
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler
-from telegram.error import BadRequest
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 
 from src.config import config
 from src.utils.logger import logger
 
 
+# Legacy Markdown specials (*, `, [, ]), underscores (prevent _italic_) and the backslash itself
+_MD_TABLE = str.maketrans({char: "\\" + char for char in "\\*`[]_"})
+_MD_NEEDS_ESCAPE = re.compile(r"[\\*`\[\]_]")
+
+
+# Chat and group titles repeat across every lead in a batch
+@functools.lru_cache(maxsize=1024)
 def escape_markdown(text: str) -> str:
     """Escape Markdown special characters in text (for legacy Markdown mode)"""
     if not text:
         return ""
-    # For legacy Markdown: escape *, `, [, ]
-    # For underscores: escape them to prevent italic parsing
-    text = text.replace('\\', '\\\\')  # Escape backslashes first
-    text = text.replace('*', '\\*')
-    text = text.replace('`', '\\`')
-    text = text.replace('[', '\\[')
-    text = text.replace(']', '\\]')
-    text = text.replace('_', '\\_')  # Escape underscores to prevent _italic_
-    return text
+    # Most texts have nothing to escape: return them as-is without a copy
+    if not _MD_NEEDS_ESCAPE.search(text):
+        return text
+    # Single pass over the text instead of one replace() per character
+    return text.translate(_MD_TABLE)
+
+
+# Static replies and keyboards, built once (PTB markup objects are immutable)
+_HELP_TEXT = (
+    "📚 *Доступные команды:*\n\n"
+    "*Сканирование:*\n"
+    "/scan — Меню выбора источника и типа лидов\n\n"
+    "*Управление:*\n"
+    "/pause — Приостановить авто\\-сканирование Telegram\n"
+    "/pausefb — Приостановить авто\\-сканирование Facebook\n"
+    "/resume — Возобновить Telegram\n"
+    "/resumefb — Возобновить Facebook\n\n"
+    "*Сброс:*\n"
+    "/reset — Сбросить состояние чатов Telegram\n\n"
+    "*Инфо:*\n"
+    "/status — Статус бота\n"
+    "/help — Эта справка"
+)
+
+_STATUS_TEMPLATE = (
+    "📊 *Статус бота*\n\n"
+    "📱 *Telegram*: {tg_status}\n"
+    "🕐 Последнее: {last_tg}\n\n"
+    "📘 *Facebook* {fb_enabled}: {fb_status}\n"
+    "🕐 Последнее: {last_fb}"
+)
+
+_SOURCE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📱 Telegram", callback_data="source:tg")],
+    [InlineKeyboardButton("📘 Facebook", callback_data="source:fb")],
+])
+
+_TYPE_KEYBOARDS = {
+    source: InlineKeyboardMarkup([
+        [InlineKeyboardButton("🏠 Недвижимость / 🚗 Транспорт", callback_data=f"run:{source}:property")],
+        [InlineKeyboardButton("💻 IT-услуги / AI / Боты", callback_data=f"run:{source}:it_services")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="back:source")],
+    ])
+    for source in ("tg", "fb")
+}
+
+# Single-lead notifications: one format_map pass over precomputed fields
+_LEAD_TYPES = {"property": ("🏠", "Недвижимость")}
+_OTHER_LEAD_TYPE = ("🚗", "Транспорт")
+
+_LEAD_TEMPLATE = (
+    "{emoji} *Новый лид!* ({pct}%)\n"
+    "📋 Тип: {label}\n\n"
+    "👤 Контакт: {contact}\n"
+    "💬 Чат: {chat_link}\n"
+    "📝 Сообщение:\n{text}\n\n"
+    "💡 {reason}"
+)
+
+_FACEBOOK_LEAD_TEMPLATE = (
+    "📘 {emoji} *Facebook лид!* ({pct}%)\n"
+    "📋 Тип: {label}\n\n"
+    "👤 Автор: {contact}\n"
+    "💬 Группа: [{group}]({post_url})\n"
+    "📝 Пост:\n{text}\n\n"
+    "💡 {reason}"
+)
 
 
 class NotificationBot:
     def __init__(self):
-        self.app = Application.builder().token(config.bot_token).build()
+        # Each update is handled in its own task: /status answers while a /scan reply is pending
+        self.app = Application.builder().token(config.bot_token).concurrent_updates(True).build()
         self.bot = self.app.bot
         self.chat_id = config.admin_chat_id
         self._process_callback: Callable | None = None  # callback(prompt_type) -> None
@@ -66,7 +135,9 @@ class NotificationBot:
 
         await self.app.initialize()
         await self.app.start()
-        await self.app.updater.start_polling(drop_pending_updates=True, poll_interval=10.0)
+        # Long polling: Telegram holds getUpdates open for up to 25s and answers as soon as
+        # an update arrives, so buttons respond immediately without extra requests
+        await self.app.updater.start_polling(drop_pending_updates=True, poll_interval=0.0, timeout=25)
         logger.info("Bot started with command handlers")
 
     async def stop(self):
@@ -89,30 +160,19 @@ class NotificationBot:
 
     async def _show_source_selection(self, message):
         """Show source selection buttons (Telegram/Facebook)"""
-        keyboard = [
-            [InlineKeyboardButton("📱 Telegram", callback_data="source:tg")],
-            [InlineKeyboardButton("📘 Facebook", callback_data="source:fb")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await message.reply_text(
             "🔍 *Выберите источник:*",
-            parse_mode="Markdown",
-            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=_SOURCE_KEYBOARD,
         )
 
     async def _show_type_selection(self, query, source: str):
         """Show lead type selection buttons (Property/IT)"""
-        keyboard = [
-            [InlineKeyboardButton("🏠 Недвижимость / 🚗 Транспорт", callback_data=f"run:{source}:property")],
-            [InlineKeyboardButton("💻 IT-услуги / AI / Боты", callback_data=f"run:{source}:it_services")],
-            [InlineKeyboardButton("⬅️ Назад", callback_data="back:source")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
         source_name = "Telegram" if source == "tg" else "Facebook"
         await query.edit_message_text(
             f"📌 *{source_name}* — выберите тип лидов:",
-            parse_mode="Markdown",
-            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=_TYPE_KEYBOARDS[source],
         )
 
     async def _handle_callback(self, update: Update, context):
@@ -128,15 +188,10 @@ class NotificationBot:
         
         # Back to source selection
         elif data == "back:source":
-            keyboard = [
-                [InlineKeyboardButton("📱 Telegram", callback_data="source:tg")],
-                [InlineKeyboardButton("📘 Facebook", callback_data="source:fb")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
             await query.edit_message_text(
                 "🔍 *Выберите источник:*",
-                parse_mode="Markdown",
-                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=_SOURCE_KEYBOARD,
             )
         
         # Run scan: run:tg:property or run:fb:it_services
@@ -193,12 +248,10 @@ class NotificationBot:
         last_fb = self.last_facebook_scan_time.strftime("%H:%M:%S") if self.last_facebook_scan_time else "—"
         
         await update.message.reply_text(
-            f"📊 *Статус бота*\n\n"
-            f"📱 *Telegram*: {tg_status}\n"
-            f"🕐 Последнее: {last_tg}\n\n"
-            f"📘 *Facebook* {fb_enabled}: {fb_status}\n"
-            f"🕐 Последнее: {last_fb}",
-            parse_mode="Markdown"
+            _STATUS_TEMPLATE.format(
+                tg_status=tg_status, last_tg=last_tg, fb_enabled=fb_enabled, fb_status=fb_status, last_fb=last_fb
+            ),
+            parse_mode=ParseMode.MARKDOWN
         )
 
     async def _handle_reset(self, update: Update, context):
@@ -214,22 +267,7 @@ class NotificationBot:
 
     async def _handle_help(self, update: Update, context):
         """Handle /help command - show all available commands"""
-        help_text = (
-            "📚 *Доступные команды:*\n\n"
-            "*Сканирование:*\n"
-            "/scan — Меню выбора источника и типа лидов\n\n"
-            "*Управление:*\n"
-            "/pause — Приостановить авто\\-сканирование Telegram\n"
-            "/pausefb — Приостановить авто\\-сканирование Facebook\n"
-            "/resume — Возобновить Telegram\n"
-            "/resumefb — Возобновить Facebook\n\n"
-            "*Сброс:*\n"
-            "/reset — Сбросить состояние чатов Telegram\n\n"
-            "*Инфо:*\n"
-            "/status — Статус бота\n"
-            "/help — Эта справка"
-        )
-        await update.message.reply_text(help_text, parse_mode="Markdown")
+        await update.message.reply_text(_HELP_TEXT, parse_mode=ParseMode.MARKDOWN)
 
     async def send_lead(
         self,
@@ -253,44 +291,37 @@ class NotificationBot:
             name = first_name or "Пользователь"
             contact = f"[{escape_markdown(name)}](tg://user?id={user_id})"
 
-        # Build message link
+        # Build message link: public chat by username, private chat via internal /c/ format
         if chat_username:
-            # Public chat
-            if topic_id:
-                msg_link = f"https://t.me/{chat_username}/{topic_id}/{message_id}"
-            else:
-                msg_link = f"https://t.me/{chat_username}/{message_id}"
-            chat_link = f"[{escape_markdown(chat_title)}]({msg_link})"
+            chat_path = chat_username
+            chat_title_safe = escape_markdown(chat_title)
         else:
-            # Private chat - use internal link format
-            chat_id_positive = abs(chat_id) % (10**10)  # Convert to positive format
-            if topic_id:
-                msg_link = f"https://t.me/c/{chat_id_positive}/{topic_id}/{message_id}"
-            else:
-                msg_link = f"https://t.me/c/{chat_id_positive}/{message_id}"
+            chat_path = f"c/{abs(chat_id) % (10**10)}"  # Convert to positive format
             chat_title_safe = escape_markdown(chat_title or 'Приватный чат')
-            chat_link = f"[{chat_title_safe}]({msg_link})"
+        topic_part = f"{topic_id}/" if topic_id else ""
+        msg_link = f"https://t.me/{chat_path}/{topic_part}{message_id}"
 
         # Type-specific emoji and label
-        type_emoji = "🏠" if lead_type == "property" else "🚗"
-        type_label = "Недвижимость" if lead_type == "property" else "Транспорт"
+        type_emoji, type_label = _LEAD_TYPES.get(lead_type, _OTHER_LEAD_TYPE)
 
         confidence_pct = int(confidence * 100)
-        message = (
-            f"{type_emoji} *Новый лид!* ({confidence_pct}%)\n"
-            f"📋 Тип: {type_label}\n\n"
-            f"👤 Контакт: {contact}\n"
-            f"💬 Чат: {chat_link}\n"
-            f"📝 Сообщение:\n{escape_markdown(text[:400])}\n\n"
-            f"💡 {escape_markdown(reason)}"
-        )
+        message = _LEAD_TEMPLATE.format_map({
+            "emoji": type_emoji,
+            "label": type_label,
+            "pct": confidence_pct,
+            "contact": contact,
+            "chat_link": f"[{chat_title_safe}]({msg_link})",
+            "text": escape_markdown(text[:400]),
+            "reason": escape_markdown(reason),
+        })
 
         try:
             logger.debug(f"Sending lead (len={len(message)}): {message[:300]}...")
             await self.bot.send_message(
                 chat_id=self.chat_id,
                 text=message,
-                parse_mode="Markdown",
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True,
             )
             logger.info(f"Lead sent: user_id={user_id}")
         except BadRequest as e:
@@ -310,6 +341,7 @@ class NotificationBot:
                 await self.bot.send_message(
                     chat_id=self.chat_id,
                     text=plain_message,
+                    disable_web_page_preview=True,
                 )
                 logger.info(f"Lead sent (plain fallback): user_id={user_id}")
             except Exception as e2:
@@ -350,8 +382,9 @@ class NotificationBot:
             await self.bot.send_message(
                 chat_id=self.chat_id,
                 text=message,
-                parse_mode="Markdown",
+                parse_mode=ParseMode.MARKDOWN,
                 reply_markup=reply_markup,
+                disable_web_page_preview=True,
             )
             logger.info(f"Stats sent ({source}): total={total}, filtered={filtered}, analyzed={analyzed}, leads={leads}")
         except Exception as e:
@@ -376,29 +409,45 @@ class NotificationBot:
             contact = author_name
 
         # Type-specific emoji and label
-        type_emoji = "🏠" if lead_type == "property" else "🚗"
-        type_label = "Недвижимость" if lead_type == "property" else "Транспорт"
-
-        confidence_pct = int(confidence * 100)
-        message = (
-            f"📘 {type_emoji} *Facebook лид!* ({confidence_pct}%)\n"
-            f"📋 Тип: {type_label}\n\n"
-            f"👤 Автор: {contact}\n"
-            f"💬 Группа: [{escape_markdown(group_name)}]({post_url})\n"
-            f"📝 Пост:\n{escape_markdown(text[:400])}\n\n"
-            f"💡 {escape_markdown(reason)}"
-        )
+        type_emoji, type_label = _LEAD_TYPES.get(lead_type, _OTHER_LEAD_TYPE)
+
+        message = _FACEBOOK_LEAD_TEMPLATE.format_map({
+            "emoji": type_emoji,
+            "label": type_label,
+            "pct": int(confidence * 100),
+            "contact": contact,
+            "group": escape_markdown(group_name),
+            "post_url": post_url,
+            "text": escape_markdown(text[:400]),
+            "reason": escape_markdown(reason),
+        })
 
         try:
             await self.bot.send_message(
                 chat_id=self.chat_id,
                 text=message,
-                parse_mode="Markdown",
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True,
             )
             logger.info(f"Facebook lead sent: author={author_name}")
         except Exception as e:
             logger.error(f"Failed to send Facebook lead: {e}")
 
+    async def _send_with_flood_wait(self, **kwargs):
+        """
+        send_message to the admin chat. On a flood-control error (too many messages
+        in a burst) wait as long as Telegram asks and retry, instead of dropping the
+        rest of the batch.
+        """
+        for attempt in range(3):
+            try:
+                return await self.bot.send_message(chat_id=self.chat_id, **kwargs)
+            except RetryAfter as e:
+                if attempt == 2:
+                    raise
+                logger.warning(f"Telegram flood control, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
     async def send_leads_batch(
         self,
         leads: list[dict],
@@ -460,10 +509,9 @@ class NotificationBot:
         # Send all messages
         for msg in messages:
             try:
-                await self.bot.send_message(
-                    chat_id=self.chat_id,
+                await self._send_with_flood_wait(
                     text=msg,
-                    parse_mode="Markdown",
+                    parse_mode=ParseMode.MARKDOWN,
                     disable_web_page_preview=True,
                 )
             except BadRequest as e:
@@ -472,13 +520,15 @@ class NotificationBot:
                 # Strip markdown formatting for plain text
                 plain_msg = msg.replace('*', '').replace('_', '').replace('\\', '')
                 try:
-                    await self.bot.send_message(
-                        chat_id=self.chat_id,
+                    await self._send_with_flood_wait(
                         text=plain_msg,
                         disable_web_page_preview=True,
                     )
                 except Exception as e2:
                     logger.error(f"Failed to send even plain text: {e2}")
+            except RetryAfter as e:
+                # Still flood-limited after retries: skip this part, keep sending the rest
+                logger.error(f"Telegram flood control persists, lead message skipped: {e}")
         logger.info(f"{source_name} leads batch sent: {len(leads)} leads in {len(messages)} message(s)")
 
     async def send_group_breakdown(
@@ -511,7 +561,7 @@ class NotificationBot:
             await self.bot.send_message(
                 chat_id=self.chat_id,
                 text=message,
-                parse_mode="Markdown",
+                parse_mode=ParseMode.MARKDOWN,
                 disable_web_page_preview=True,
             )
         except Exception as e:
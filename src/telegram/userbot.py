@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from dataclasses import dataclass
 from datetime import datetime
@@ -5,6 +6,7 @@ from pathlib import Path
 
 from telethon import TelegramClient
 from telethon.tl.types import DialogFilter
+from telethon.utils import get_peer_id
 
 from telethon.tl.functions.messages import GetDialogFiltersRequest
 
@@ -45,20 +47,20 @@ class UserBot:
         await self.client.disconnect()
         logger.info("Userbot stopped")
 
-    async def get_all_group_chats(self) -> list:
-        """Get all group chats from account dialogs (excludes broadcast channels)"""
+    async def iter_group_chats(self):
+        """Yield group chats from account dialogs as they arrive (excludes broadcast channels)"""
         from telethon.tl.types import Channel, Chat
-        
-        peers = []
+
         async for dialog in self.client.iter_dialogs():
             entity = dialog.entity
             # Only groups: Chat (small groups) or Channel with megagroup=True
             # Skip broadcast channels (megagroup=False)
-            if isinstance(entity, Chat):
-                peers.append(entity)
-            elif isinstance(entity, Channel) and getattr(entity, 'megagroup', False):
-                peers.append(entity)
-        
+            if isinstance(entity, Chat) or (isinstance(entity, Channel) and getattr(entity, 'megagroup', False)):
+                yield entity
+
+    async def get_all_group_chats(self) -> list:
+        """Get all group chats from account dialogs (excludes broadcast channels)"""
+        peers = [entity async for entity in self.iter_group_chats()]
         logger.info(f"Found {len(peers)} group chats in account")
         return peers
 
@@ -123,6 +125,9 @@ class UserBot:
             chat_username = getattr(entity, "username", None)
             is_forum = getattr(entity, "forum", False)
 
+            # First pass: collect messages, reply ids and senders without extra requests
+            raw = []
+            reply_ids = set()
             async for msg in self.client.iter_messages(
                 entity,
                 min_id=min_id or 0,
@@ -131,26 +136,46 @@ class UserBot:
                 if not msg.text or not msg.sender_id:
                     continue
 
-                sender = await msg.get_sender()
-                if not sender:
-                    continue
-
                 # Extract topic_id for forum chats
                 topic_id = None
-                if is_forum and msg.reply_to:
-                    topic_id = getattr(msg.reply_to, "reply_to_top_id", None) or getattr(msg.reply_to, "reply_to_msg_id", None)
-
-                # Fetch reply-to message text (truncated to 200 chars)
-                reply_to_text = None
-                if msg.reply_to and not is_forum:
-                    reply_to_msg_id = getattr(msg.reply_to, "reply_to_msg_id", None)
-                    if reply_to_msg_id:
-                        try:
-                            reply_msg = await self.client.get_messages(entity, ids=reply_to_msg_id)
-                            if reply_msg and reply_msg.text:
-                                reply_to_text = reply_msg.text[:200]
-                        except:
-                            pass  # Ignore errors fetching reply
+                reply_to_msg_id = None
+                if msg.reply_to:
+                    if is_forum:
+                        topic_id = getattr(msg.reply_to, "reply_to_top_id", None) or getattr(msg.reply_to, "reply_to_msg_id", None)
+                    else:
+                        reply_to_msg_id = getattr(msg.reply_to, "reply_to_msg_id", None)
+                        if reply_to_msg_id:
+                            reply_ids.add(reply_to_msg_id)
+
+                raw.append((msg, topic_id, reply_to_msg_id))
+
+            # Senders come with the history response; resolve the rest in one call
+            senders = {msg.sender_id: msg.sender for msg, _, _ in raw if msg.sender}
+            missing = list({msg.sender_id for msg, _, _ in raw} - senders.keys())
+            if missing:
+                try:
+                    for sender in await self.client.get_entity(missing):
+                        senders[get_peer_id(sender)] = sender  # Marked id, same form as msg.sender_id
+                except (ValueError, TypeError):
+                    # Some aren't in the entity cache: resolve via their messages instead
+                    for msg, _, _ in raw:
+                        if msg.sender_id not in senders:
+                            senders[msg.sender_id] = await msg.get_sender()
+
+            # Fetch reply-to message texts (truncated to 200 chars) in one request
+            reply_texts = {}
+            if reply_ids:
+                try:
+                    for reply_msg in await self.client.get_messages(entity, ids=list(reply_ids)):
+                        if reply_msg and reply_msg.text:
+                            reply_texts[reply_msg.id] = reply_msg.text[:200]
+                except Exception:
+                    pass  # Ignore errors fetching replies
+
+            for msg, topic_id, reply_to_msg_id in raw:
+                sender = senders.get(msg.sender_id)
+                if not sender:
+                    continue
 
                 messages.append(
                     ParsedMessage(
@@ -164,7 +189,7 @@ class UserBot:
                         text=msg.text,
                         date=msg.date,
                         topic_id=topic_id,
-                        reply_to_text=reply_to_text,
+                        reply_to_text=reply_texts.get(reply_to_msg_id),
                     )
                 )
 
@@ -173,6 +198,19 @@ class UserBot:
 
         return messages
 
+    async def get_new_messages_many(self, peers_with_min_id: list[tuple], concurrency: int = 5) -> list[list[ParsedMessage]]:
+        """
+        Get new messages from many chats concurrently. peers_with_min_id = [(peer, min_id), ...]
+        Returns message lists in the same order. Concurrency is bounded to stay clear of flood limits.
+        """
+        limit = asyncio.Semaphore(concurrency)
+
+        async def fetch(peer, min_id):
+            async with limit:
+                return await self.get_new_messages(peer, min_id)
+
+        return await asyncio.gather(*(fetch(peer, min_id) for peer, min_id in peers_with_min_id))
+
 
 async def auth():
     """Interactive authentication for first run"""
@@ -187,8 +225,6 @@ async def auth():
 
 
 if __name__ == "__main__":
-    import asyncio
-
     if "--auth" in sys.argv:
         SESSION_PATH.parent.mkdir(parents=True, exist_ok=True)
         asyncio.run(auth())
@@ -1,4 +1,8 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
 
@@ -33,59 +37,78 @@ class ColoredFormatter(logging.Formatter):
         return super().format(record)
 
 
-# Setup colored logging
+# Colors only on a terminal: in Docker / log files the escape codes are just noise
+LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+IS_TTY = sys.stdout.isatty()
+
 handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(ColoredFormatter(
-    fmt="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-))
+handler.setFormatter(
+    ColoredFormatter(fmt=LOG_FORMAT, datefmt=DATE_FORMAT)
+    if IS_TTY
+    else logging.Formatter(fmt=LOG_FORMAT.replace("%(levelname)s", "%(levelname)-8s"), datefmt=DATE_FORMAT)
+)
+
+# Records are formatted and written by a listener thread, so logging from
+# coroutines doesn't block the event loop on stdout
+_log_queue = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_log_queue, handler)
+_listener.start()
+atexit.register(_listener.stop)
+
+queue_handler = logging.handlers.QueueHandler(_log_queue)
+queue_handler.setFormatter(logging.Formatter("%(message)s"))  # basicConfig would add its own
 
 logging.basicConfig(
     level=logging.INFO,
-    handlers=[handler],
+    handlers=[queue_handler],
 )
 
 logger = logging.getLogger("leads-tg")
+# LOG_LEVEL=DEBUG shows message previews and prompts (libraries stay at INFO)
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+if LOG_LEVEL in logging.getLevelNamesMapping():
+    logger.setLevel(LOG_LEVEL)
+else:
+    logger.setLevel(logging.INFO)
+    logger.warning(f"Unknown LOG_LEVEL={LOG_LEVEL!r}, using INFO")
 
 
-# Helper functions for colored debug output
-def log_new_post(text_preview: str, source: str = ""):
-    """Log new post in GREEN"""
-    src = f"[{source}] " if source else ""
-    print(f"{Colors.GREEN}✓ NEW POST {src}{Colors.RESET}{text_preview[:80]}...")
-
-
-def log_old_post(post_id: str, source: str = ""):
-    """Log skipped old post in GRAY"""
-    src = f"[{source}] " if source else ""
-    print(f"{Colors.GRAY}○ OLD POST {src}id={post_id} (already processed){Colors.RESET}")
+# Helper functions for colored debug output. The bulky previews are DEBUG-only:
+# with the default INFO level nothing is sliced or formatted for them.
+def _paint(color: str, text: str) -> str:
+    return f"{color}{text}{Colors.RESET}" if IS_TTY else text
 
 
 def log_text_preview(idx: int, text: str, max_len: int = 100):
     """Log text being analyzed in CYAN"""
-    preview = text[:max_len].replace('\n', ' ')
-    print(f"{Colors.CYAN}[{idx}] {preview}{'...' if len(text) > max_len else ''}{Colors.RESET}")
+    if logger.isEnabledFor(logging.DEBUG):
+        preview = text[:max_len].replace('\n', ' ')
+        logger.debug(_paint(Colors.CYAN, f"[{idx}] {preview}{'...' if len(text) > max_len else ''}"))
 
 
 def log_prompt(prompt: str, label: str = "LLM PROMPT"):
     """Log full prompt in YELLOW (truncated)"""
-    print(f"{Colors.YELLOW}━━━ {label} ━━━{Colors.RESET}")
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     # Show first 500 and last 200 chars for long prompts
     if len(prompt) > 800:
-        print(f"{Colors.YELLOW}{prompt[:500]}{Colors.RESET}")
-        print(f"{Colors.GRAY}... [{len(prompt) - 700} chars hidden] ...{Colors.RESET}")
-        print(f"{Colors.YELLOW}{prompt[-200:]}{Colors.RESET}")
+        body = "\n".join((
+            _paint(Colors.YELLOW, prompt[:500]),
+            _paint(Colors.GRAY, f"... [{len(prompt) - 700} chars hidden] ..."),
+            _paint(Colors.YELLOW, prompt[-200:]),
+        ))
     else:
-        print(f"{Colors.YELLOW}{prompt}{Colors.RESET}")
-    print(f"{Colors.YELLOW}━━━ END PROMPT ━━━{Colors.RESET}")
+        body = _paint(Colors.YELLOW, prompt)
+    logger.debug("\n".join((_paint(Colors.YELLOW, f"━━━ {label} ━━━"), body, _paint(Colors.YELLOW, "━━━ END PROMPT ━━━"))))
 
 
 def log_lead_found(lead_type: str, reason: str, confidence: float):
     """Log lead found in MAGENTA"""
     emoji = "🏠" if lead_type == "property" else "🚗"
-    print(f"{Colors.MAGENTA}{Colors.BOLD}{emoji} LEAD FOUND: {reason} ({confidence:.0%}){Colors.RESET}")
+    logger.info(_paint(Colors.MAGENTA + Colors.BOLD, f"{emoji} LEAD FOUND: {reason} ({confidence:.0%})"))
 
 
 def log_analysis_result(total: int, leads: int):
     """Log analysis summary in BLUE"""
-    print(f"{Colors.BLUE}{Colors.BOLD}📊 Analysis: {total} texts → {leads} leads{Colors.RESET}")
+    logger.info(_paint(Colors.BLUE + Colors.BOLD, f"📊 Analysis: {total} texts → {leads} leads"))